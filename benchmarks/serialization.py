@@ -0,0 +1,55 @@
+# per request serialisation cost of a feed page, jsonable_encoder + JSONResponse against ORJSONResponse
+#
+#   python benchmarks/serialization.py [number of requests]
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+def feed_page(pins_per_page=20):
+    """
+    A feed response as api_get_pins builds it, PinCard fields as they come out of the database
+    :param pins_per_page:
+    :return:
+    """
+    now = datetime.utcnow()
+    pins = [
+        {
+            "pin_id": uuid4(),
+            "created_at": now - timedelta(minutes=i),
+            "title": f"Pin number {i}",
+            "category": "photography",
+            "image_id": f"images/{uuid4().hex}/474w.webp",
+            "image_variants": [{"url": f"images/{uuid4().hex}/{width}w.{image_format}", "width": width,
+                                "height": width * 3 // 2, "format": image_format}
+                               for width in (236, 474, 736) for image_format in ("webp", "avif")],
+            "posted_by": "someone",
+        } for i in range(pins_per_page)
+    ]
+    return {"pins": pins, "page": 0, "filters": {}, "entries_per_page": pins_per_page, "total_results": 12345,
+            "next_cursor": "eyJjIjoiMjAyMi0wNS0wMVQxMjozMDoxNSIsImkiOiIwIn0"}
+
+
+def before(page):
+    # the endpoint's jsonable_encoder, then FastAPI's own pass over the returned dict, then json.dumps
+    return JSONResponse(jsonable_encoder(jsonable_encoder(page))).body
+
+
+def after(page):
+    return ORJSONResponse(page).body
+
+
+def main(number=2000):
+    page = feed_page()
+    for name, serialise in (("jsonable_encoder + JSONResponse", before), ("ORJSONResponse", after)):
+        seconds = min(timeit.repeat(lambda: serialise(page), number=number, repeat=5))
+        print(f"{name:34} {seconds / number * 1e6:9.1f} us/request  {len(serialise(page)):6} bytes")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,9 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-from pintrigue_backend.api.endpoints import auth, pin, user, comment
+from pintrigue_backend.api.endpoints import auth, pin, user, comment, save, metrics
+from pintrigue_backend.api.auth.passwords import password_pool
+from pintrigue_backend.api.image_utils import image_pool, UploadLimitMiddleware
+from pintrigue_backend.api.rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
+from pintrigue_backend.api.tasks import category_counts_task, typeahead_task
+from pintrigue_backend.database.motor.client import open_client, close_client
+from pintrigue_backend.database.mongodb.indexes import require_indexes
+from pintrigue_backend.database.motor.indexes import ensure_indexes, verify_indexes
+from pintrigue_backend.database.storage import close_storage
 
-app = FastAPI()
+# orjson serialises the UUIDs and datetimes of database documents natively
+app = FastAPI(default_response_class=ORJSONResponse)
 
 origins = [
     'https://localhost:3000',
@@ -11,10 +21,43 @@ origins = [
     'http://localhost:3000/'
 ]
 
+
+# open the shared async mongodb client once per worker and make sure the indexes exist, close it on shut down
+@app.on_event("startup")
+async def startup():
+    await open_client()
+    await ensure_indexes()
+    # sign up relies on the unique user indexes to refuse duplicates, don't serve without them
+    require_indexes(await verify_indexes())
+    image_pool.start()
+    password_pool.start()
+    category_counts_task.start()
+    typeahead_task.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await category_counts_task.stop()
+    await typeahead_task.stop()
+    close_client()
+    image_pool.shutdown()
+    password_pool.shutdown()
+    close_storage()
+
+
 app.include_router(auth.router)
 app.include_router(pin.router)
 app.include_router(user.router)
 app.include_router(comment.router)
+app.include_router(save.router)
+app.include_router(metrics.router)
+
+# added first so the rate limit answers before any of the body is read, and CORS wraps both
+app.add_middleware(UploadLimitMiddleware)
+
+# added before CORS so CORS wraps it and 429 responses carry the CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
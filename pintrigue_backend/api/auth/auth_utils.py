@@ -1,47 +1,44 @@
 import os
 from datetime import datetime, timedelta
+from uuid import uuid4
 from dotenv import load_dotenv
 from typing import Union
 import logging
 
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
-from pintrigue_backend.database.mongodb.db_user import get_user, verify_active_session, get_user_by_id
+from pintrigue_backend.database.cache import user_cache, user_cache_key
+from pintrigue_backend.database.motor.db_user import get_user, verify_active_session, get_user_by_id, \
+    rehash_password
 from pintrigue_backend.schemas.schemas import UserWithID
+from .passwords import pwd_context, verify_password, get_password_hash, check_password
 
 load_dotenv()
 
 # JWT variables
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or 30)
 TOKEN_URL = os.getenv("TOKEN_URL")
 
 oauth2 = OAuth2PasswordBearer(tokenUrl=TOKEN_URL)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-# verify hashed password with the plain
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-# has the entered password
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
 
 # authenticate user by verifying the given password with username and hashed password
-def authenticate_user(username: str, password: str) -> any:
+async def authenticate_user(username: str, password: str) -> any:
     logging.info(f"Authenticate_user: authenticating {username}")
-    user = get_user(username)
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user['password']):
+    # bcrypt is CPU bound, verify in the password process pool
+    valid, new_hash = await check_password(password, user['password'])
+    if not valid:
         return False
+    # the hash is deprecated (e.g. PASSWORD_HASH_ROUNDS was raised), store the one made from the verified password
+    if new_hash:
+        await rehash_password(user_id=user['user_id'], old_password=user['password'], new_password=new_hash)
     return user
 
 
@@ -51,35 +48,63 @@ def authenticate_user(username: str, password: str) -> any:
 
 
 # create access token function
-def create_access_token(subject: Union[str, any], expires_delta: timedelta = None) -> str:
+def create_access_token(subject: Union[str, any], expires_delta: timedelta = None) -> dict:
+    """
+    Sign an access token with a unique id (jti), the session created on login is keyed by it
+    :param subject:
+    :param expires_delta:
+    :return: {"token", "jti", "expires_at"}
+    """
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode = {"exp": expire, "sub": str(subject)}
+    jti = uuid4().hex
+    to_encode = {"exp": expire, "sub": str(subject), "jti": jti}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return {"token": encoded_jwt, "jti": jti, "expires_at": expire}
 
 
-# get the current user
-def get_current_user(token: str = Depends(oauth2)) -> any:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+# decode the bearer token, once per request however many dependencies need it
+async def get_token_payload(token: str = Depends(oauth2)) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        # token_data = TokenData(**payload)
-        logging.info("Get_current_user: Fetching user")
-        user_id: str = payload.get("sub")
-        print(f"User_id fetched from payload - {user_id}")
-        user = get_user_by_id(user_id=user_id)
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise credentials_exception
+
+
+# get the current user
+async def get_current_user(payload: dict = Depends(get_token_payload)) -> any:
+    logging.info("Get_current_user: Fetching user")
+    user_id: str = payload.get("sub")
+    print(f"User_id fetched from payload - {user_id}")
+    try:
+        key = user_cache_key(user_id)
+    except ValueError:
+        raise credentials_exception
+
+    # the user is cached for USER_CACHE_TTL seconds, username/password changes and deletes invalidate it
+    cache = user_cache()
+    user = await cache.aget(key)
+    if user is None:
+        user = await get_user_by_id(user_id=user_id)
+        if user is None:
+            raise credentials_exception
+        user = {field: value for field, value in user.items() if field != "password"}
+        await cache.aset(key, user)
     return user
 
 
-def get_current_active_user(current_user: UserWithID = Depends(get_current_user)):
-    if verify_active_session(current_user["user_id"]):
-        return current_user
+# the current user, as long as the session of the token has not been revoked (logged out)
+async def get_current_active_user(payload: dict = Depends(get_token_payload),
+                                  current_user: UserWithID = Depends(get_current_user)):
+    if not payload.get("jti") or not await verify_active_session(payload["jti"]):
+        raise credentials_exception
+    return current_user
@@ -0,0 +1,76 @@
+# password hashing, bcrypt runs in its own process pool so a burst of logins can't hold the threadpool and event
+# loop serving every other request
+
+import os
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from ..workers import BoundedProcessPool
+
+load_dotenv()
+
+# env variables
+# bcrypt cost, hashes made with fewer rounds are upgraded on the next login
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", PASSWORD_POOL_WORKERS * 8))
+# schemes of older hashes still accepted on login and replaced with bcrypt, e.g. sha256_crypt
+PASSWORD_LEGACY_SCHEMES = [scheme for scheme in os.getenv("PASSWORD_LEGACY_SCHEMES", "").split(",") if scheme]
+
+
+def password_context(rounds, legacy_schemes=()):
+    """
+    bcrypt with rounds, hashes of the legacy schemes or with fewer rounds verify but are flagged for an update
+    :param rounds:
+    :param legacy_schemes:
+    :return:
+    """
+    return CryptContext(schemes=["bcrypt", *legacy_schemes], default="bcrypt", deprecated="auto",
+                        bcrypt__rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+pwd_context = password_context(PASSWORD_HASH_ROUNDS, PASSWORD_LEGACY_SCHEMES)
+
+# process pool the auth and user endpoints hand hashing to
+password_pool = BoundedProcessPool("password", max_workers=PASSWORD_POOL_WORKERS,
+                                   max_pending=PASSWORD_POOL_MAX_PENDING)
+
+
+# verify hashed password with the plain
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+# hash the entered password
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+def verify_and_update_password(plain_password, hashed_password):
+    """
+    Verify a password and rehash it when its hash is deprecated (another scheme or fewer than PASSWORD_HASH_ROUNDS)
+    :param plain_password:
+    :param hashed_password:
+    :return: (valid, new hash or None)
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+async def hash_password(password):
+    """
+    get_password_hash in a password_pool worker, raises PoolSaturated when the pool is full
+    :param password:
+    :return:
+    """
+    return await password_pool.submit(get_password_hash, password)
+
+
+async def check_password(plain_password, hashed_password):
+    """
+    verify_and_update_password in a password_pool worker, raises PoolSaturated when the pool is full
+    :param plain_password:
+    :param hashed_password:
+    :return: (valid, new hash or None)
+    """
+    return await password_pool.submit(verify_and_update_password, plain_password, hashed_password)
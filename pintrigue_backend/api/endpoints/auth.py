@@ -6,9 +6,12 @@ import logging
 from fastapi import Depends, APIRouter, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 
-from ..auth.auth_utils import authenticate_user, create_access_token, get_current_active_user
+from ..auth.auth_utils import authenticate_user, create_access_token, get_current_active_user, \
+    get_token_payload, ACCESS_TOKEN_EXPIRE_MINUTES
 from pintrigue_backend.schemas.schemas import Token, UserWithID
-from pintrigue_backend.database.mongodb.db_user import login
+from pintrigue_backend.database.motor.db_user import login, revoke_session, revoke_user_sessions
+from ..rate_limit import limit_username
+from ..workers import PoolSaturated
 
 
 router = APIRouter(
@@ -17,30 +20,61 @@ router = APIRouter(
 )
 
 
-@router.post("/login/access-token", response_model=Token)
-def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+# limited per username here and per IP by RateLimitMiddleware, both before bcrypt runs
+@router.post("/login/access-token", response_model=Token, dependencies=[Depends(limit_username)])
+async def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     logging.info("login_access_token: authenticating user")
-    user = authenticate_user(username=form_data.username, password=form_data.password)
+    try:
+        user = await authenticate_user(username=form_data.username, password=form_data.password)
+    except PoolSaturated:
+        raise HTTPException(429, "Too many sign ins, try again shortly", headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     # elif not utils.is_active(user):
     #     raise HTTPException(status_code=400, detail="Inactive user")
-    access_token_expires = timedelta(minutes=30)
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    jwt = create_access_token(
+    access_token = create_access_token(
                 user['user_id'], expires_delta=access_token_expires
             )
-    try:
-        login(user_id=user['user_id'], jwt=jwt)
-        response_object = {
-            "access_token": jwt,
-            "token_type": "bearer",
-        }
-        return response_object
-    except Exception as e:
-        return {"error": e}
+    response = await login(user_id=user['user_id'], jti=access_token["jti"], expires_at=access_token["expires_at"])
+    if "error" in response:
+        raise HTTPException(status_code=500, detail="Could not start a session")
+    response_object = {
+        "access_token": access_token["token"],
+        "token_type": "bearer",
+    }
+    return response_object
 
 
 @router.get("/me", response_model=UserWithID)
 async def get_users_me(current_user: UserWithID = Depends(get_current_active_user)) -> any:
     return current_user
+
+
+@router.post("/logout")
+async def logout(payload: dict = Depends(get_token_payload),
+                 current_user: UserWithID = Depends(get_current_active_user)):
+    """
+    Revoke the access token the request was made with
+    :param payload:
+    :param current_user:
+    :return:
+    """
+    response = await revoke_session(payload["jti"])
+    if "error" in response:
+        raise HTTPException(status_code=500, detail="Could not log out")
+    return {"success": True}
+
+
+@router.post("/revoke-all")
+async def revoke_all(current_user: UserWithID = Depends(get_current_active_user)):
+    """
+    Revoke every access token of the current user, e.g. after a lost device
+    :param current_user:
+    :return:
+    """
+    response = await revoke_user_sessions(current_user["user_id"])
+    if "error" in response:
+        raise HTTPException(status_code=500, detail="Could not revoke sessions")
+    return {"success": True}
@@ -1,8 +1,13 @@
 # comment endpoints
 
+from typing import List, Optional
+
 from fastapi import HTTPException, APIRouter
+from fastapi.responses import ORJSONResponse
 
-from pintrigue_backend.database.mongodb.db_comment import create_comment, update_comment, delete_comment
+from pintrigue_backend.database.motor.db_comment import create_comment, update_comment, delete_comment, \
+    get_comments_by_pin, create_comments
+from pintrigue_backend.database.mongodb.bulk import BULK_MAX_ITEMS
 from pintrigue_backend.schemas.schemas import Comment
 
 router = APIRouter(
@@ -11,26 +16,66 @@ router = APIRouter(
 )
 
 
+@router.get("/by_pin/{pin_id}")
+async def api_get_comments_by_pin(pin_id: str, cursor: Optional[str] = None):
+    """
+    Comments of a pin newest first. Pass the next_cursor of a response, or the next_comments_cursor of the pin, as
+    cursor to get the following page
+    :param pin_id:
+    :param cursor:
+    :return:
+    """
+    comments_per_page = 20
+
+    try:
+        comments, next_cursor = await get_comments_by_pin(pin_id, comments_per_page, cursor=cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid pin_id or cursor")
+
+    response = {
+        "comments": comments,
+        "pin_id": pin_id,
+        "entries_per_page": comments_per_page,
+        "next_cursor": next_cursor
+    }
+    return ORJSONResponse(response)
+
+
 @router.post("/add_comment")
-def api_add_comment(comment: Comment):
-    response = create_comment(pin_id=comment.pin_id, posted_by=comment.posted_by, comment=comment.comment)
+async def api_add_comment(comment: Comment):
+    response = await create_comment(pin_id=comment.pin_id, posted_by=comment.posted_by, comment=comment.comment)
     print(f"Received response: {response}")
     if response:
         return {"success": True}
     raise HTTPException(400, "Something went wrong")
 
 
+@router.post("/add_comments")
+async def api_add_comments(comments: List[Comment]):
+    """
+    Add a batch of comments in one write, items that fail are listed by their position in the batch
+    :param comments:
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    if len(comments) > BULK_MAX_ITEMS:
+        raise HTTPException(400, f"At most {BULK_MAX_ITEMS} comments per batch")
+    response = await create_comments([comment.dict() for comment in comments])
+    if "error" in response:
+        raise HTTPException(400, "Something went wrong")
+    return response
+
+
 @router.put("/update_comment/<comment_id>")
-def api_update_comment(comment_id: str, comment: str):
-    response = update_comment(comment_id=comment_id, comment=comment)
+async def api_update_comment(comment_id: str, comment: str):
+    response = await update_comment(comment_id=comment_id, comment=comment)
     if response:
         return {"success": True}
     raise HTTPException(400, "Something went wrong")
 
 
 @router.delete("/delete_comment")
-def api_delete_comment(comment_id: str):
-    response = delete_comment(comment_id=comment_id)
+async def api_delete_comment(comment_id: str):
+    response = await delete_comment(comment_id=comment_id)
     if response:
         return {"success": True}
     raise HTTPException(400, "Something went wrong")
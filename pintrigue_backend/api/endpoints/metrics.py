@@ -0,0 +1,37 @@
+# metrics endpoints
+
+from fastapi import APIRouter
+
+from pintrigue_backend.database.cache import cache_stats
+from pintrigue_backend.database.typeahead import pin_typeahead
+from ..auth.passwords import password_pool
+from ..image_utils import image_pool
+from ..rate_limit import rate_limit_store
+from ..tasks import category_counts_task, typeahead_task
+
+router = APIRouter(
+    prefix="/api/metrics",
+    tags=["metrics"]
+)
+
+
+@router.get("/")
+async def api_get_metrics():
+    """
+    Cache hit/miss counters, worker pool usage, background task runs and rate limited requests of this worker
+    process
+    :return:
+    """
+    return {
+        "caches": cache_stats(),
+        "pools": {
+            "image": image_pool.stats(),
+            "password": password_pool.stats()
+        },
+        "tasks": {
+            "category_counts": category_counts_task.stats(),
+            "typeahead": typeahead_task.stats()
+        },
+        "typeahead": pin_typeahead.stats(),
+        "rate_limit": rate_limit_store().stats()
+    }
@@ -1,17 +1,25 @@
 # pin endpoints
 
+import io
 import os
+from datetime import datetime
 from dotenv import load_dotenv
+from typing import Optional
 
 from fastapi import HTTPException, APIRouter, Request, UploadFile, File, Depends
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
 
 
-from pintrigue_backend.database.google_cloud.google_cloud import upload_blob, get_image_url
-from pintrigue_backend.database.mongodb.db_pin import get_pins, get_pin_by_id, get_pins_by_category, create_pin, \
-    get_pin, delete_pin, update_pin_image, get_popular_pin_categories, get_all_pins
+from pintrigue_backend.database.storage import upload_blobs, get_image_url
+from pintrigue_backend.database.typeahead import pin_typeahead
+from pintrigue_backend.database.motor.db_image import get_image_by_hash, get_image_by_phash, add_image
+from pintrigue_backend.database.motor.db_pin import get_pins, get_pin_by_id, get_pins_by_category, create_pin, \
+    get_pin, delete_pin, update_pin_image, get_popular_pin_categories, get_all_pins, search_pins, pin_projection
 from pintrigue_backend.schemas.schemas import PinCreate, Pin
-from ..image_utils import convert_image
+from ..image_utils import convert_image, default_variant, image_pool, spool_upload, variant_blob_name, \
+    ImageTooLarge, IMAGE_DEDUP_PERCEPTUAL
+from ..workers import PoolSaturated
 
 load_dotenv()
 
@@ -24,32 +32,74 @@ router = APIRouter(
 )
 
 
+def fields_projection(fields):
+    """
+    Projection for the fields query parameter of pin listings, comma separated pin fields. Pins are listed as
+    PinCard when it is not given
+    :param fields:
+    :return:
+    """
+    try:
+        return pin_projection(fields.split(",") if fields else None)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
 @router.get("/")
-def api_get_pins():
+async def api_get_pins(cursor: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Feed end point. Pass the next_cursor of a response as cursor to get the following page
+    :param cursor:
+    :param fields: comma separated pin fields to return instead of the PinCard ones
+    :return:
+    """
     pins_per_page = 20
+    projection = fields_projection(fields)
 
-    (pins, total_num_entries) = get_pins(filters=None, page=0, pins_per_page=pins_per_page)
+    try:
+        (pins, total_num_entries, next_cursor) = await get_pins(filters=None, page=0, pins_per_page=pins_per_page,
+                                                                cursor=cursor, projection=projection)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
 
     response = {
         "pins": pins,
         "page": 0,
         "filters": {},
         "entries_per_page": pins_per_page,
-        "total_results": total_num_entries
+        "total_results": total_num_entries,
+        "next_cursor": next_cursor
     }
-    return jsonable_encoder(response)
+    return ORJSONResponse(response)
 
 
-@router.get("/all-pins")
-def api_get_all_pins():
-    response = get_all_pins()
-    return jsonable_encoder(response)
+@router.get("/all-pins", deprecated=True)
+async def api_get_all_pins():
+    """
+    Every pin, for client side auto-complete. Deprecated, use /typeahead
+    :return:
+    """
+    response = await get_all_pins()
+    return ORJSONResponse(response)
+
+
+@router.get("/typeahead")
+async def api_typeahead(q: str, limit: int = 10):
+    """
+    Auto-complete end point, pins with a title word or category starting with q
+    :param q:
+    :param limit:
+    :return:
+    """
+    return ORJSONResponse({"query": q, "results": pin_typeahead.search(q, limit)})
 
 
 @router.get("/search")
-def api_search_pins(request: Request):
+async def api_search_pins(request: Request):
     """
-    Search end point, can search by posted_by or category
+    Search end point, can search by posted_by, category and creation date.
+    Pins are listed as PinCard, or with the comma separated pin fields given as fields=
+    Pages with page=N, or with cursor=<next_cursor of the previous response> which does not slow down on deep pages
     :param request:
     :return:
     """
@@ -59,123 +109,228 @@ def api_search_pins(request: Request):
     try:
         page = int(request.query_params['page'])
         print("Current Page: ", page)
-    except (TypeError, ValueError) as e:
+    except (KeyError, TypeError, ValueError) as e:
         print('Got a bad value: ', e)
         page = 0
 
-    # get the filters
+    # get the filters, all of them are applied together. category and posted_by can be repeated to match any of
+    # several values, created_after/created_before are ISO 8601 datetimes
     filters = {}
     filter_results = {}
-    category = request.query_params['category']
+    category = [value for value in request.query_params.getlist('category') if value]
     print("Received category param ", category)
-    posted_by = request.query_params['posted_by']
+    posted_by = [value for value in request.query_params.getlist('posted_by') if value]
     if category:
         filters["category"] = category
         filter_results["category"] = category
     if posted_by:
         filters["posted_by"] = posted_by
         filter_results["posted_by"] = posted_by
+    for bound in ("created_after", "created_before"):
+        if request.query_params.get(bound):
+            try:
+                filters[bound] = datetime.fromisoformat(request.query_params[bound])
+            except ValueError:
+                raise HTTPException(400, f"Invalid {bound}")
+            filter_results[bound] = request.query_params[bound]
+
+    cursor = request.query_params.get('cursor')
+    projection = fields_projection(request.query_params.get('fields'))
 
     # query the database and get the necessary info
-    (pins, total_num_entries) = get_pins(filters, page, default_pins_per_page)
+    try:
+        (pins, total_num_entries, next_cursor) = await get_pins(filters, page, default_pins_per_page, cursor=cursor,
+                                                                projection=projection)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
 
     response = {
         "pins": pins,
         "page": page,
         "filters": filter_results,
         "entries_per_page": default_pins_per_page,
-        "total_results": total_num_entries
+        "total_results": total_num_entries,
+        "next_cursor": next_cursor
     }
 
-    return jsonable_encoder(response)
+    return ORJSONResponse(response)
+
+
+@router.get("/search/text")
+async def api_text_search_pins(q: str, category: Optional[str] = None, posted_by: Optional[str] = None,
+                               cursor: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Full text search end point, pins ranked by relevance to q, optionally narrowed to a category and/or poster.
+    Pass the next_cursor of a response as cursor to get the following page
+    :param q:
+    :param category:
+    :param posted_by:
+    :param cursor:
+    :param fields: comma separated pin fields to return instead of the PinCard ones
+    :return:
+    """
+    pins_per_page = 20
+    projection = fields_projection(fields)
+
+    filters = {}
+    if category:
+        filters["category"] = category
+    if posted_by:
+        filters["posted_by"] = posted_by
+
+    try:
+        pins, next_cursor = await search_pins(q, filters, pins_per_page, cursor=cursor, projection=projection)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    response = {
+        "pins": pins,
+        "query": q,
+        "filters": filters,
+        "entries_per_page": pins_per_page,
+        "next_cursor": next_cursor
+    }
+    return ORJSONResponse(response)
 
 
 @router.get("/<pin_id>")
-def api_search_pin_by_id(pin_id):
-    pin = get_pin_by_id(pin_id)
+async def api_search_pin_by_id(pin_id):
+    pin = await get_pin_by_id(pin_id)
     print(f"Returned pin info: {pin}")
     if pin is None:
         return {"Error": "Pin not found"}
     else:
-        return pin
+        return ORJSONResponse(pin)
 
 
 @router.get("/popular")
-def api_search_popular_pins(limit: int):
-    pin = get_popular_pin_categories(limit=limit)
+async def api_search_popular_pins(limit: int):
+    pin = await get_popular_pin_categories(limit=limit)
     print("Popular Pins returned ", pin)
-    return jsonable_encoder(pin)
+    return ORJSONResponse(pin)
 
 
 @router.get("/category")
-def api_get_pins_by_category(request: Request):
+async def api_get_pins_by_category(request: Request):
     print("Response received: ", request)
+    projection = fields_projection(request.query_params.get('fields'))
     try:
         categories = request.query_params['category']
         print("Categories: ", categories)
-        results = get_pins_by_category(categories=categories)
+        results = await get_pins_by_category(categories=categories, projection=projection)
         print("Results sent: ", results)
-        return jsonable_encoder(results)
+        return ORJSONResponse(results)
     except Exception as e:
         response = {"Error": e}
         return jsonable_encoder(response)
 
 
+async def process_image_upload(file: UploadFile = File(...)):
+    """
+    - Stream the upload to a temporary file, rejecting it with 413 past IMAGE_MAX_UPLOAD_BYTES
+    - Look the upload up by content hash, an image that was already stored is reused without converting it again
+    - Otherwise decode it once in the image process pool and encode all of its responsive variants
+    - Upload every variant to object storage under images/<sha256>/ and record it in the images collection
+    :param file:
+    :return: {"image_id": url of the default variant, "image_variants": [{"url", "width", "height", "format"}]}
+    """
+    print("Received file", file.filename)
+    try:
+        path, sha256 = await spool_upload(file)
+    except ImageTooLarge as e:
+        raise HTTPException(413, str(e))
+
+    try:
+        existing = await get_image_by_hash(sha256)
+        if existing:
+            return {"image_id": existing["image_id"], "image_variants": existing["image_variants"]}
+
+        # Pillow is CPU bound, convert in the image process pool and answer 429 when it is saturated
+        converted = await image_pool.submit(convert_image, path)
+    except PoolSaturated:
+        raise HTTPException(429, "Too many images being processed, try again shortly", headers={"Retry-After": "1"})
+    except ImageTooLarge as e:
+        raise HTTPException(413, str(e))
+    except ValueError:
+        raise HTTPException(400, "Could not read the uploaded image")
+    finally:
+        os.unlink(path)
+
+    if IMAGE_DEDUP_PERCEPTUAL:
+        similar = await get_image_by_phash(converted["phash"])
+        if similar:
+            await add_image(sha256=sha256, phash=converted["phash"], image_id=similar["image_id"],
+                            image_variants=similar["image_variants"])
+            return {"image_id": similar["image_id"], "image_variants": similar["image_variants"]}
+
+    blobs = []
+    image_variants = []
+    for variant in converted["variants"]:
+        blob_name = variant_blob_name(f"images/{sha256}", variant["width"], variant["format"])
+        blobs.append((io.BytesIO(variant["data"]), blob_name, f"image/{variant['format']}"))
+        image_variants.append({
+            "url": get_image_url(source_blob_name=blob_name),
+            "width": variant["width"],
+            "height": variant["height"],
+            "format": variant["format"]
+        })
+    # all variants are uploaded concurrently
+    await upload_blobs(blobs)
+    image_id = default_variant(image_variants)["url"]
+    await add_image(sha256=sha256, phash=converted["phash"], image_id=image_id, image_variants=image_variants)
+    return {"image_id": image_id, "image_variants": image_variants}
+
+
 @router.post("/upload_image")
-def api_upload_image(file: UploadFile = File(...)):
+async def api_upload_image(file: UploadFile = File(...)):
     """
-    - Using UploadFile, intake the file and then upload to Google Cloud Storage
-    - Once blob has been uploaded use the get_image_url function to create a URL and return as response
+    - Using UploadFile, intake the file and then upload its variants to object storage
+    - Return the URL of the default variant, the full set is stored on the pin by create_pin and update_pin_image
     :param file:
     :return:
     """
-    print("Received file", file.filename)
-    image_old = file.file
-    image_new = f"{file.filename[:-4]}.webp"
-    print("New image filename", image_new)
-    im = convert_image(image_old=image_old)
-    upload_blob(source_file_name=im, destination_blob_name=image_new)
-    image_id = get_image_url(source_blob_name=image_new)
-    return image_id
+    image = await process_image_upload(file)
+    return image["image_id"]
 
 
 @router.put("/update_pin_image", response_model=Pin)
-def api_update_pin_image(pin_id, image_id: str = Depends(api_upload_image)):
-    response = update_pin_image(pin_id=pin_id, image_id=image_id)
+async def api_update_pin_image(pin_id, image: dict = Depends(process_image_upload)):
+    response = await update_pin_image(pin_id=pin_id, image_id=image["image_id"],
+                                      image_variants=image["image_variants"])
     if response:
-        return get_pin_by_id(pin_id=pin_id)
+        return await get_pin_by_id(pin_id=pin_id)
     raise HTTPException(400, "Something went wrong")
 
 
 @router.post("/create_pin")
-def api_create_pin(pin: PinCreate = Depends(PinCreate.as_form)):
+async def api_create_pin(pin: PinCreate = Depends(PinCreate.as_form)):
     """
-    All newly created pins have the "no image" url in the image_id
-    Using the Pin schema, input all pin fields in order to create a pin using create_pin
-    :param image_id:
+    Using the Pin schema, input all pin fields in order to create a pin using create_pin.
+    The uploaded image is stored as a set of responsive variants, image_id holds the default one
     :param pin:
     :return:
     """
     print("Form data received", pin)
-    image_id = api_upload_image(pin.image_id)
-    print("Image file received: ", image_id)
-    response = create_pin(title=pin.title, about=pin.about, category=pin.category.lower(),
-                          image_id=image_id, posted_by=pin.postedby)
+    image = await process_image_upload(pin.image_id)
+    print("Image file received: ", image["image_id"])
+    response = await create_pin(title=pin.title, about=pin.about, category=pin.category.lower(),
+                                image_id=image["image_id"], posted_by=pin.postedby,
+                                image_variants=image["image_variants"])
     print("Response received:", response)
     if response:
-        new_pin = get_pin(title=pin.title, posted_by=pin.postedby)
+        new_pin = await get_pin(title=pin.title, posted_by=pin.postedby)
         return new_pin
     raise HTTPException(400, "Something went wrong")
 
 
 @router.delete("/delete_pin/<pin_id>")
-def api_delete_pin(pin_id):
+async def api_delete_pin(pin_id):
     """
     Using the pin_id, delete the pin from the pins collection
     :param pin_id:
     :return:
     """
-    response = delete_pin(pin_id)
+    response = await delete_pin(pin_id)
     if response:
         return {"success": True}
     raise HTTPException(400, "Something went wrong, pin was not deleted")
@@ -1,10 +1,12 @@
 # save endpoints
 
+from typing import List
+
 from fastapi import HTTPException, APIRouter
-from fastapi.encoders import jsonable_encoder
 
 from pintrigue_backend.schemas.schemas import Save
-from pintrigue_backend.database.mongodb.db_save import add_save, remove_save
+from pintrigue_backend.database.motor.db_save import add_save, add_saves, remove_save
+from pintrigue_backend.database.mongodb.bulk import BULK_MAX_ITEMS
 
 router = APIRouter(
     prefix="/api/saves",
@@ -13,13 +15,28 @@ router = APIRouter(
 
 
 @router.post("/create_save")
-def api_create_save(save: Save):
-    response = add_save(posted_by=save.posted_by, user_id=save.user_id)
+async def api_create_save(save: Save):
+    response = await add_save(posted_by=save.posted_by, user_id=save.user_id)
     if response:
         return {"success": True}
     raise HTTPException(400, "Something went wrong")
 
 
+@router.post("/create_saves")
+async def api_create_saves(saves: List[Save]):
+    """
+    Add a batch of saves in one write, items that fail are listed by their position in the batch
+    :param saves:
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    if len(saves) > BULK_MAX_ITEMS:
+        raise HTTPException(400, f"At most {BULK_MAX_ITEMS} saves per batch")
+    response = await add_saves([save.dict() for save in saves])
+    if "error" in response:
+        raise HTTPException(400, "Something went wrong")
+    return response
+
+
 @router.delete("/remove_save")
-def api_remove_save(save_id: str):
-    response = remove_save(save_id=save_id)
+async def api_remove_save(save_id: str):
+    response = await remove_save(save_id=save_id)
@@ -5,12 +5,12 @@ from dotenv import load_dotenv
 from typing import List
 
 from fastapi import HTTPException, APIRouter
-from fastapi.encoders import jsonable_encoder
 
 from pintrigue_backend.schemas.schemas import User, UserCreate, UserWithID
-from pintrigue_backend.database.mongodb.db_user import get_user, get_all_users, create_user, delete_user, \
-    update_username, update_password, get_user_by_email
-from ..auth.auth_utils import get_password_hash
+from pintrigue_backend.database.motor.db_user import get_user, get_all_users, create_user, delete_user, \
+    update_username, update_password
+from ..auth.passwords import hash_password
+from ..workers import PoolSaturated
 
 
 load_dotenv()
@@ -25,30 +25,30 @@ router = APIRouter(
 
 
 @router.get("/", response_model=List[UserWithID])
-def api_get_users():
+async def api_get_users():
     """
     Endpoint for querying all users in the user's collection
     :return:
     """
-    response = get_all_users()
-    return jsonable_encoder(response)
+    response = await get_all_users()
+    return response
 
 
 @router.get("/<username>", response_model=UserWithID)
-def api_get_user_by_username(username: str):
+async def api_get_user_by_username(username: str):
     """
     Search for a user by their username
     :param username:
     :return:
     """
-    response = get_user(username)
+    response = await get_user(username)
     if response:
-        return jsonable_encoder(response)
+        return response
     raise HTTPException(404, f'No user found with the username {username}')
 
 
 @router.post("/sign-up", response_model=UserWithID)
-def api_user_signup(user: UserCreate) -> any:
+async def api_user_signup(user: UserCreate) -> any:
     """
     Sign up end-point, take the following input to create a new user:
     email
@@ -71,22 +71,26 @@ def api_user_signup(user: UserCreate) -> any:
         raise HTTPException(400, "Missing password")
     elif len(user.password) < 5:
         raise HTTPException(400, "Password must be 5 or more characters.")
-    elif get_user(user.username):
-        raise HTTPException(400, "Username already exists")
-    elif user.email == get_user_by_email(user.email):
-        raise HTTPException(400, "Email already in use")
 
     image_id = f"https://storage.googleapis.com/{BUCKET_NAME}/no_image.webp"
-    response = create_user(name=user.name, username=user.username, email=user.email,
-                           hashedpw=get_password_hash(user.password), image_id=image_id)
-    if response:
-        new_user = get_user(username=user.username)
-        return jsonable_encoder(new_user)
+    try:
+        hashedpw = await hash_password(user.password)
+    except PoolSaturated:
+        raise HTTPException(429, "Too many sign ups, try again shortly", headers={"Retry-After": "1"})
+    # taken usernames and emails are refused by the unique indexes, no lookup before the insert
+    response = await create_user(name=user.name, username=user.username, email=user.email,
+                                 hashedpw=hashedpw, image_id=image_id)
+    if "user" in response:
+        return response["user"]
+    if response.get("field") == "username":
+        raise HTTPException(400, "Username already exists")
+    if response.get("field") == "email":
+        raise HTTPException(400, "Email already in use")
     raise HTTPException(400, "Something went wrong")
 
 
 @router.put("/update_username/<user_id>/<username>", response_model=User)
-def api_update_user_username(current_username: str, new_username: str, user_id: str):
+async def api_update_user_username(current_username: str, new_username: str, user_id: str):
     """
     Using the entered parameters, update the username of a user. Query using the get_user() function to search for the
     user and send as response
@@ -102,16 +106,18 @@ def api_update_user_username(current_username: str, new_username: str, user_id:
     if len(new_username) < 4:
         raise HTTPException(400, "Username too short")
     print(f"New info - user_id: {user_id} - current_username: {current_username} - new_username: {new_username}")
-    response = update_username(user_id=user_id, current_username=current_username, new_username=new_username)
+    response = await update_username(user_id=user_id, current_username=current_username, new_username=new_username)
 
-    if response:
-        res = get_user(new_username)
-        return jsonable_encoder(res)
-    raise HTTPException(400, "Something went wrong")
+    if "error" in response:
+        if response.get("field") == "username":
+            raise HTTPException(400, "Username already exists")
+        raise HTTPException(400, "Something went wrong")
+    res = await get_user(new_username)
+    return res
 
 
 @router.put("/password-change/<user_id>/")
-def api_update_user_password(user_id: str, new_password: str) -> any:
+async def api_update_user_password(user_id: str, new_password: str) -> any:
     """
     Use the user_id to query the db and then enter the new_password into the doc
     :param user_id:
@@ -123,7 +129,11 @@ def api_update_user_password(user_id: str, new_password: str) -> any:
     if len(new_password) > 12:
         raise HTTPException(400, "Password must be less than 12 characters.")
 
-    response = update_password(user_id=user_id, new_password=get_password_hash(new_password))
+    try:
+        hashedpw = await hash_password(new_password)
+    except PoolSaturated:
+        raise HTTPException(429, "Too many password changes, try again shortly", headers={"Retry-After": "1"})
+    response = await update_password(user_id=user_id, new_password=hashedpw)
 
     if response:
         return response
@@ -131,14 +141,14 @@ def api_update_user_password(user_id: str, new_password: str) -> any:
 
 
 @router.delete("/<user_id>")
-def api_delete_user(user_id: str, email: str):
+async def api_delete_user(user_id: str, email: str):
     """
     Use the entered user_id and email to delete a user
     :param user_id:
     :param email:
     :return:
     """
-    response = delete_user(user_id=user_id, email=email)
+    response = await delete_user(user_id=user_id, email=email)
     if response:
         return response
     raise HTTPException(400, "Something went wrong")
@@ -1,16 +1,196 @@
+import hashlib
 import io
+import os
+import tempfile
 
-from PIL import Image
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from PIL import Image, ImageOps, features
 
+from .workers import BoundedProcessPool
 
-def convert_image(image_old):
-    size = 350, 350
+load_dotenv()
+
+# env variables
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", os.cpu_count() or 1))
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", IMAGE_POOL_WORKERS * 4))
+
+# upload limits, checked while streaming the upload (bytes) and before the full decode (pixels)
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 50_000_000))
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+# room for the multipart boundaries and the other form fields (title, about, ...) on top of the image itself
+UPLOAD_FORM_OVERHEAD = int(os.getenv("UPLOAD_FORM_OVERHEAD", 64 * 1024))
+# routes whose request body carries an image, limited by UploadLimitMiddleware
+UPLOAD_PATHS = ["/api/pins/upload_image", "/api/pins/update_pin_image", "/api/pins/create_pin"]
+
+# responsive variants, every upload is resized to each width (never upscaled) plus the original capped at
+# IMAGE_MAX_WIDTH, and each size is encoded in every format
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "236,474,736").split(",")]
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", 1472))
+IMAGE_DEFAULT_WIDTH = int(os.getenv("IMAGE_DEFAULT_WIDTH", 474))  # the variant stored as a pin's image_id
+IMAGE_FORMATS = [image_format for image_format in os.getenv("IMAGE_FORMATS", "webp,avif").split(",")
+                 if features.check(image_format)]  # AVIF needs a Pillow built with libavif
+
+IMAGE_QUALITY = {"webp": 80, "avif": 60}
+
+# reuse an already stored image whose perceptual hash matches, not only byte identical uploads
+IMAGE_DEDUP_PERCEPTUAL = os.getenv("IMAGE_DEDUP_PERCEPTUAL", "false").lower() == "true"
+
+# process pool the upload endpoints hand image conversion to
+image_pool = BoundedProcessPool("image", max_workers=IMAGE_POOL_WORKERS, max_pending=IMAGE_POOL_MAX_PENDING)
+
+
+class ImageTooLarge(ValueError):
+    """
+    Raised when an upload is over IMAGE_MAX_UPLOAD_BYTES or IMAGE_MAX_PIXELS
+    """
+
+
+class UploadLimitMiddleware:
+    """
+    Answers 413 to an upload whose body is over IMAGE_MAX_UPLOAD_BYTES plus UPLOAD_FORM_OVERHEAD before Starlette has
+    parsed and spooled the whole multipart form: up front from its Content-Length, or for a body sent without one
+    (or longer than it said) as soon as the limit is passed, after which the rest of the body isn't read
+    """
+
+    def __init__(self, app, paths=None, max_bytes=None):
+        self.app = app
+        self.paths = tuple(UPLOAD_PATHS if paths is None else paths)
+        self.max_bytes = IMAGE_MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD if max_bytes is None else max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT") or \
+                not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        too_large = ORJSONResponse({"detail": f"Upload is larger than {IMAGE_MAX_UPLOAD_BYTES} bytes"},
+                                   status_code=413)
+        content_length = dict(scope.get("headers", [])).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        refused = False
+
+        async def limited_receive():
+            nonlocal received, refused
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes and not refused:
+                    # answer now and end the body as a disconnect, the form parser stops reading it
+                    refused = True
+                    await too_large(scope, receive, send)
+            return {"type": "http.disconnect"} if refused else message
+
+        async def limited_send(message):
+            # the app's own answer to the cut off body (a 400) is dropped, the 413 has been sent
+            if not refused:
+                await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
+
+
+async def spool_upload(file):
+    """
+    Stream an UploadFile to a temporary file chunk by chunk, hashing it on the way, so at most one chunk of the
+    upload is held in memory. The caller removes the file once it is done with it.
+    Raises ImageTooLarge as soon as more than IMAGE_MAX_UPLOAD_BYTES have been read
+    :param file:
+    :return: (path of the temporary file, SHA-256 of the upload)
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    spool = tempfile.NamedTemporaryFile(prefix="pintrigue-upload-", delete=False)
     try:
-        with Image.open(image_old) as im:
-            output = io.BytesIO()
-            im.thumbnail(size=size)
-            im.save(output, format="WebP")
-            output.seek(0)
-            return output
+        while chunk := await file.read(UPLOAD_READ_CHUNK_SIZE):
+            size += len(chunk)
+            if size > IMAGE_MAX_UPLOAD_BYTES:
+                raise ImageTooLarge(f"Upload is larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
+            sha256.update(chunk)
+            await run_in_threadpool(spool.write, chunk)
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+    spool.close()
+    return spool.name, sha256.hexdigest()
+
+
+def variant_blob_name(base_name, width, image_format):
+    """
+    Deterministic blob name for one variant of an upload
+    :param base_name:
+    :param width:
+    :param image_format:
+    :return:
+    """
+    return f"{base_name}/{width}w.{image_format}"
+
+
+def perceptual_hash(im):
+    """
+    64 bit difference hash (dHash) of an image, near duplicates (re-encodes, resizes) share the same value
+    :param im:
+    :return: the hash as 16 hex characters
+    """
+    pixels = im.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def convert_image(source):
+    """
+    Decode an uploaded image once and encode every responsive variant from it, runs inside an image_pool worker
+    process. The pixel count is checked from the header before decoding, JPEGs are decoded straight at the smallest
+    DCT scale that still covers IMAGE_MAX_WIDTH, and sizes are produced largest first, each resized from the
+    previous one.
+    Raises ImageTooLarge for more than IMAGE_MAX_PIXELS, ValueError if the source is not an image Pillow can read
+    :param source: path of the spooled upload, or a file object
+    :return: {"phash": perceptual hash, "variants": list of {"width", "height", "format", "data"}, largest first}
+    """
+    try:
+        with Image.open(source) as im:
+            if im.width * im.height > IMAGE_MAX_PIXELS:
+                raise ImageTooLarge(f"Image is larger than {IMAGE_MAX_PIXELS} pixels")
+            im.draft("RGB", (IMAGE_MAX_WIDTH, IMAGE_MAX_WIDTH))
+            im = ImageOps.exif_transpose(im)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "PA") else "RGB")
+
+            original_width = min(im.width, IMAGE_MAX_WIDTH)
+            widths = sorted({width for width in IMAGE_VARIANT_WIDTHS if width < original_width} | {original_width},
+                            reverse=True)
+
+            variants = []
+            for width in widths:
+                if width != im.width:
+                    im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS,
+                                   reducing_gap=3.0)
+                for image_format in IMAGE_FORMATS:
+                    output = io.BytesIO()
+                    im.save(output, format=image_format, quality=IMAGE_QUALITY.get(image_format, 80))
+                    variants.append({"width": im.width, "height": im.height, "format": image_format,
+                                     "data": output.getvalue()})
+            return {"phash": perceptual_hash(im), "variants": variants}
+    except ImageTooLarge:
+        raise
     except Exception as e:
-        return {"ERROR:", e}
+        raise ValueError(f"Could not convert image: {e}")
+
+
+def default_variant(variants):
+    """
+    Pick the WebP variant closest to IMAGE_DEFAULT_WIDTH, used as the image_id of clients without srcset support
+    :param variants:
+    :return:
+    """
+    webp = [variant for variant in variants if variant["format"] == "webp"] or variants
+    return min(webp, key=lambda variant: abs(variant["width"] - IMAGE_DEFAULT_WIDTH))
@@ -0,0 +1,263 @@
+# token bucket rate limits in front of the endpoints that do expensive work (bcrypt, Pillow), in process by default
+# or shared through redis
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from fastapi.responses import ORJSONResponse
+from fastapi.security import OAuth2PasswordRequestForm
+
+from pintrigue_backend.database.cache import REDIS_URL
+
+load_dotenv()
+
+# env variables
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory or redis
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# behind a reverse proxy, take the client address from the last X-Forwarded-For entry (the one the proxy added)
+RATE_LIMIT_FORWARDED_FOR = os.getenv("RATE_LIMIT_FORWARDED_FOR", "false").lower() == "true"
+
+# per client IP, requests per minute and the burst allowed on top of that rate
+RATE_LIMIT_AUTH_PER_MINUTE = float(os.getenv("RATE_LIMIT_AUTH_PER_MINUTE", 10))
+RATE_LIMIT_AUTH_BURST = int(os.getenv("RATE_LIMIT_AUTH_BURST", 10))
+RATE_LIMIT_UPLOAD_PER_MINUTE = float(os.getenv("RATE_LIMIT_UPLOAD_PER_MINUTE", 30))
+RATE_LIMIT_UPLOAD_BURST = int(os.getenv("RATE_LIMIT_UPLOAD_BURST", 10))
+# per username, sign in attempts whatever address they come from
+RATE_LIMIT_USERNAME_PER_MINUTE = float(os.getenv("RATE_LIMIT_USERNAME_PER_MINUTE", 1))
+RATE_LIMIT_USERNAME_BURST = int(os.getenv("RATE_LIMIT_USERNAME_BURST", 5))
+
+"""
+Per IP rules applied by RateLimitMiddleware, a request counts against the first rule whose method and path prefix
+match it
+"""
+
+RATE_LIMIT_RULES = [
+    {
+        "name": "auth",
+        "methods": {"POST", "PUT"},
+        "paths": ["/api/auth/login", "/api/users/sign-up", "/api/users/password-change"],
+        "rate": RATE_LIMIT_AUTH_PER_MINUTE / 60,
+        "burst": RATE_LIMIT_AUTH_BURST,
+    },
+    {
+        "name": "upload",
+        "methods": {"POST", "PUT"},
+        "paths": ["/api/pins/upload_image", "/api/pins/update_pin_image", "/api/pins/create_pin"],
+        "rate": RATE_LIMIT_UPLOAD_PER_MINUTE / 60,
+        "burst": RATE_LIMIT_UPLOAD_BURST,
+    },
+]
+
+
+class RateLimitStore:
+    """
+    Token buckets by key. A bucket holds up to burst tokens and refills at rate tokens per second, every request
+    takes one. Every method has an async twin, backends whose calls don't block (the in-process one) simply share
+    the implementation
+    """
+
+    def __init__(self):
+        self.allowed = 0
+        self.limited = 0
+
+    def _take(self, key, rate, burst):
+        raise NotImplementedError
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket of key
+        :param key:
+        :param rate: tokens per second
+        :param burst: bucket size
+        :return: 0 when the request is allowed, otherwise the seconds until a token is available
+        """
+        return self._count(self._take(key, rate, burst))
+
+    async def atake(self, key, rate, burst):
+        return self.take(key, rate, burst)
+
+    def _count(self, retry_after):
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self):
+        return {"allowed": self.allowed, "limited": self.limited}
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Buckets of this worker process, the least recently used are dropped past max_keys (a dropped bucket is full
+    again, which only ever lets a request through)
+    """
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        super().__init__()
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, key, rate, burst):
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            retry_after = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+    def stats(self):
+        return {**super().stats(), "keys": len(self._buckets)}
+
+
+# refill and take in one step on the server, so concurrent workers can't both spend the last token. The retry time
+# is returned as a string, Lua numbers are truncated to integers on the way out
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Buckets shared by every worker through redis (or anything speaking its protocol, e.g. a local stand-in in
+    development). A bucket expires once it would be full again
+    """
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        import redis.asyncio
+        self._take_script = redis.Redis.from_url(REDIS_URL).register_script(TAKE_SCRIPT)
+        self._async_take_script = redis.asyncio.Redis.from_url(REDIS_URL).register_script(TAKE_SCRIPT)
+
+    @staticmethod
+    def _key(key):
+        return f"pintrigue:rate_limit:{key}"
+
+    def _take(self, key, rate, burst):
+        return float(self._take_script(keys=[self._key(key)], args=[rate, burst]))
+
+    async def atake(self, key, rate, burst):
+        return self._count(float(await self._async_take_script(keys=[self._key(key)], args=[rate, burst])))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def rate_limit_store():
+    """
+    The store of this process, built with the configured backend on first use
+    :return:
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if RATE_LIMIT_BACKEND == "redis":
+                _store = RedisRateLimitStore()
+            elif RATE_LIMIT_BACKEND == "memory":
+                _store = MemoryRateLimitStore()
+            else:
+                raise ValueError(f"Unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND}")
+        return _store
+
+
+def match_rule(rules, method, path):
+    """
+    :param rules:
+    :param method:
+    :param path:
+    :return: the first rule for method and path, None when the request isn't limited
+    """
+    for rule in rules:
+        if method in rule["methods"] and any(path.startswith(prefix) for prefix in rule["paths"]):
+            return rule
+    return None
+
+
+def client_ip(scope):
+    """
+    :param scope: ASGI scope of the request
+    :return: address of the client, or of the peer closest to the proxy with RATE_LIMIT_FORWARDED_FOR
+    """
+    if RATE_LIMIT_FORWARDED_FOR:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def too_many_requests(retry_after):
+    """
+    :param retry_after: seconds until the request would be allowed
+    :return: headers of a 429 response
+    """
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+class RateLimitMiddleware:
+    """
+    Answers 429 to requests over the per IP limit of their rule before they are routed, so before the body is read
+    and any hashing or image work starts
+    """
+
+    def __init__(self, app, rules=None, store=None):
+        self.app = app
+        self.rules = RATE_LIMIT_RULES if rules is None else rules
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            rule = match_rule(self.rules, scope["method"], scope["path"])
+            if rule is not None:
+                store = self.store if self.store is not None else rate_limit_store()
+                retry_after = await store.atake(f"{rule['name']}:ip:{client_ip(scope)}", rule["rate"], rule["burst"])
+                if retry_after:
+                    response = ORJSONResponse({"detail": "Too many requests, try again shortly"}, status_code=429,
+                                              headers=too_many_requests(retry_after))
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+# sign in attempts per username, so a credential stuffing run spread over many addresses is still limited
+async def limit_username(form_data: OAuth2PasswordRequestForm = Depends()):
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = await rate_limit_store().atake(f"login:username:{form_data.username.casefold()}",
+                                                 RATE_LIMIT_USERNAME_PER_MINUTE / 60, RATE_LIMIT_USERNAME_BURST)
+    if retry_after:
+        raise HTTPException(429, "Too many sign in attempts, try again shortly", headers=too_many_requests(retry_after))
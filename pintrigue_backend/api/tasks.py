@@ -0,0 +1,73 @@
+# periodic background jobs, run on the event loop of every worker
+
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from pintrigue_backend.database.motor.db_pin import reconcile_category_counts, rebuild_typeahead
+from pintrigue_backend.database.typeahead import TYPEAHEAD_REBUILD_SECONDS
+
+load_dotenv()
+
+# env variables
+CATEGORY_COUNTS_RECONCILE_SECONDS = int(os.getenv("CATEGORY_COUNTS_RECONCILE_SECONDS", 3600))
+
+
+class PeriodicTask:
+    """
+    Runs a coroutine function every interval seconds, starting right away. A failed run is logged and retried at
+    the next interval
+    """
+
+    def __init__(self, name, interval, job):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.runs = 0
+        self.failures = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.job()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"periodic task {self.name} failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Schedule the job on the running event loop, called on app start up
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Cancel the job, called on app shut down
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+        }
+
+
+# recount pins per category, the increments made on pin writes keep it current in between
+category_counts_task = PeriodicTask("category_counts", CATEGORY_COUNTS_RECONCILE_SECONDS, reconcile_category_counts)
+
+# build the typeahead index on start up, then pick up pins written through other workers
+typeahead_task = PeriodicTask("typeahead", TYPEAHEAD_REBUILD_SECONDS, rebuild_typeahead)
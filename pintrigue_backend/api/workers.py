@@ -0,0 +1,83 @@
+# bounded process pools for CPU bound request work
+
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when a pool already has max_pending tasks queued or running
+    """
+
+
+class BoundedProcessPool:
+    """
+    Process pool that work is submitted to from the event loop and awaited.
+    At most max_pending tasks are queued or running at once, further submits fail fast with PoolSaturated so the
+    endpoint can answer 429 instead of letting the backlog grow without limit.
+    Completed tasks are timed from submit to result, queueing included
+    """
+
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor = None
+
+    def start(self):
+        """
+        Create the executor, called on app start up or lazily on the first submit
+        """
+        if self._executor is None:
+            # spawn instead of fork, the parent holds driver threads and sockets
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        """
+        Stop the worker processes, called on app shut down
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, fn, *args):
+        """
+        Run fn(*args) in a worker process and return its result
+        :param fn: module level function so it can be pickled
+        :param args:
+        :return:
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolSaturated(f"{self.name} pool is saturated")
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+        elapsed = time.perf_counter() - started
+        self.completed += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        return result
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_seconds": self.total_seconds / self.completed if self.completed else 0.0,
+            "max_seconds": self.max_seconds,
+        }
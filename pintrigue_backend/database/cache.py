@@ -0,0 +1,326 @@
+# caches in front of hot database reads, in process by default or shared through redis
+
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# env variables
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # memory or redis
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class Cache:
+    """
+    TTL cache with hit/miss counters. Every method has an async twin for the motor layer, backends whose calls
+    don't block (the in-process one) simply share the implementation
+    """
+
+    def __init__(self, name, ttl, max_size):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get(self, key):
+        """
+        :param key:
+        :return: the cached value, None on a miss
+        """
+        return self._count(self._get(key))
+
+    def incr(self, key, amount):
+        """
+        Add amount to a cached number, does nothing when key is not cached
+        :param key:
+        :param amount:
+        """
+        value = self._get(key)
+        if value is not None:
+            self.set(key, value + amount)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aincr(self, key, amount):
+        self.incr(key, amount)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+    async def adelete(self, key):
+        self.delete(key)
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "ttl": self.ttl,
+            "max_size": self.max_size,
+        }
+
+
+class MemoryCache(Cache):
+    """
+    In-process LRU cache, entries expire ttl seconds after they were set
+    """
+
+    def __init__(self, name, ttl, max_size):
+        super().__init__(name, ttl, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def incr(self, key, amount):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                self._entries[key] = (expires_at, value + amount)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {**super().stats(), "size": len(self._entries)}
+
+
+# add to a cached number only while its key exists, INCRBY keeps the key's expiry so adjusting a count doesn't
+# extend how long it is trusted. One script so adjustments from concurrent workers aren't lost
+INCR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return false
+"""
+
+
+class RedisCache(Cache):
+    """
+    Cache shared by every worker through redis (or anything speaking its protocol). Integers are stored as plain
+    numbers so incr can adjust them on the server, other values are pickled.
+    max_size is left to the server's maxmemory policy
+    """
+
+    def __init__(self, name, ttl, max_size, client=None, async_client=None):
+        super().__init__(name, ttl, max_size)
+        if client is None or async_client is None:
+            import redis
+            import redis.asyncio
+            client = client or redis.Redis.from_url(REDIS_URL)
+            async_client = async_client or redis.asyncio.Redis.from_url(REDIS_URL)
+        self._redis = client
+        self._async_redis = async_client
+        self._incr_script = client.register_script(INCR_SCRIPT)
+        self._async_incr_script = async_client.register_script(INCR_SCRIPT)
+
+    def _key(self, key):
+        return f"pintrigue:{self.name}:{key}"
+
+    @staticmethod
+    def _dump(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value)
+
+    @staticmethod
+    def _load(raw):
+        if raw is None:
+            return None
+        # pickles start with the PROTO opcode, anything else is a number stored by _dump
+        return pickle.loads(raw) if raw[:1] == pickle.PROTO else int(raw)
+
+    def _get(self, key):
+        return self._load(self._redis.get(self._key(key)))
+
+    def set(self, key, value):
+        self._redis.set(self._key(key), self._dump(value), ex=self.ttl)
+
+    def incr(self, key, amount):
+        self._incr_script(keys=[self._key(key)], args=[int(amount)])
+
+    def delete(self, key):
+        self._redis.delete(self._key(key))
+
+    def clear(self):
+        for key in self._redis.scan_iter(self._key("*")):
+            self._redis.delete(key)
+
+    async def aget(self, key):
+        return self._count(self._load(await self._async_redis.get(self._key(key))))
+
+    async def aincr(self, key, amount):
+        await self._async_incr_script(keys=[self._key(key)], args=[int(amount)])
+
+    async def aset(self, key, value):
+        await self._async_redis.set(self._key(key), self._dump(value), ex=self.ttl)
+
+    async def adelete(self, key):
+        await self._async_redis.delete(self._key(key))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, ttl, max_size):
+    """
+    Return the cache called name, building it with the configured backend on first use
+    :param name:
+    :param ttl: seconds an entry stays valid
+    :param max_size: entries kept by the in-process backend
+    :return:
+    """
+    with _caches_lock:
+        if name not in _caches:
+            if CACHE_BACKEND == 'redis':
+                _caches[name] = RedisCache(name, ttl, max_size)
+            elif CACHE_BACKEND == 'memory':
+                _caches[name] = MemoryCache(name, ttl, max_size)
+            else:
+                raise ValueError(f"Unknown CACHE_BACKEND {CACHE_BACKEND}")
+        return _caches[name]
+
+
+def cache_stats():
+    """
+    Hit/miss counters of every cache in this process
+    :return:
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+"""
+Pin cache, get_pin_by_id results keyed by pin_id
+"""
+
+PIN_CACHE_TTL = int(os.getenv('PIN_CACHE_TTL', 30))
+PIN_CACHE_MAX_SIZE = int(os.getenv('PIN_CACHE_MAX_SIZE', 10000))
+
+
+def pin_cache():
+    return get_cache("pin", ttl=PIN_CACHE_TTL, max_size=PIN_CACHE_MAX_SIZE)
+
+
+def pin_cache_key(pin_id):
+    """
+    Same key for a pin_id given as a UUID or as a string in any case
+    :param pin_id:
+    :return:
+    """
+    return str(UUID(str(pin_id)))
+
+
+"""
+Pin count cache, totals of get_pins keyed by the normalised query
+"""
+
+PIN_COUNT_CACHE_TTL = int(os.getenv('PIN_COUNT_CACHE_TTL', 60))
+PIN_COUNT_CACHE_MAX_SIZE = int(os.getenv('PIN_COUNT_CACHE_MAX_SIZE', 1000))
+
+
+def pin_count_cache():
+    return get_cache("pin_count", ttl=PIN_COUNT_CACHE_TTL, max_size=PIN_COUNT_CACHE_MAX_SIZE)
+
+
+def _normalise(value):
+    if isinstance(value, dict):
+        return {key: _normalise(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted((_normalise(item) for item in value), key=str)
+    return value
+
+
+def pin_count_key(query):
+    """
+    Same key for queries that only differ in key order or in the order of $in values
+    :param query:
+    :return:
+    """
+    return json.dumps(_normalise(query), sort_keys=True, default=str)
+
+
+"""
+User cache, the user an access token belongs to keyed by user_id
+"""
+
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', 10000))
+
+
+def user_cache():
+    return get_cache("user", ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE)
+
+
+def user_cache_key(user_id):
+    """
+    Same key for a user_id given as a UUID or as a string in any case
+    :param user_id:
+    :return:
+    """
+    return str(UUID(str(user_id)))
+
+
+"""
+Session cache, whether the access token with a jti is still allowed. The TTL bounds how long a revocation made
+through another worker takes to be seen
+"""
+
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', 10))
+SESSION_CACHE_MAX_SIZE = int(os.getenv('SESSION_CACHE_MAX_SIZE', 100000))
+
+
+def session_cache():
+    return get_cache("session", ttl=SESSION_CACHE_TTL, max_size=SESSION_CACHE_MAX_SIZE)
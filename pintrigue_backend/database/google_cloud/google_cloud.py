@@ -3,61 +3,73 @@
 import os
 from dotenv import load_dotenv
 
+from google.api_core.exceptions import NotFound, TooManyRequests, InternalServerError, BadGateway, \
+    ServiceUnavailable, GatewayTimeout
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
 from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+from ..storage import StorageBackend, STORAGE_UPLOAD_CONCURRENCY
 
 load_dotenv()
 
 # env variables
 BUCKET_NAME = os.getenv('BUCKET_NAME')
 PROJECT_NAME = os.getenv('PROJECT_NAME')
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE', 'service_account.json')
+# files larger than this are sent as a resumable upload in chunks of this size, must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
 
-"""
-Set up Google cloud client, bucket and authentication
-"""
-
-
-credentials = service_account.Credentials.from_service_account_file('service_account.json')
-
-client = storage.Client(credentials=credentials, project=PROJECT_NAME)
 
-# get cloud bucket using URL
-bucket = client.get_bucket(BUCKET_NAME)
-
-
-# upload blob to google cloud
-def upload_blob(source_file_name, destination_blob_name):
+class GoogleCloudStorage(StorageBackend):
     """
-    Path to the file to upload
-    source_file_name = "local/path/to/file"
-    :param source_file_name:
-
-    ID of the object
-    destination_blob_name = the name of the object once uploaded into the bucket
-    :param destination_blob_name:
+    Google Cloud Storage backend. The client is authenticated on first use, and the bucket handle is built
+    locally without the metadata round trip client.get_bucket makes.
+    All requests share one HTTP session whose connection pool is sized for the concurrent batched uploads
     """
-    blob = bucket.blob(destination_blob_name)
-
-    return blob.upload_from_file(source_file_name)
-
-
-# download blob from google cloud
-def download_blob(source_blob_name, destination_file_name):
-    """
-    ID of the object
-    source_blob_name = "storage-object-name"
-    :param source_blob_name:
-
-    The path to which the file should be downloaded
-    destination_file_name = name of the file as we want it named in the bucket
-    :param destination_file_name:
-    """
-    blob = bucket.blob(source_blob_name)
-
-    return blob.download_to_file(destination_file_name)
-
 
-# get the public url for an image from within the bucket
-def get_image_url(source_blob_name):
-    url = f"{source_blob_name}"
-    return url
+    transient_errors = (TooManyRequests, InternalServerError, BadGateway, ServiceUnavailable, GatewayTimeout,
+                        ConnectionError, Timeout)
+
+    def __init__(self):
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        """
+        Set up Google cloud client, bucket and authentication
+        """
+        if self._bucket is None:
+            credentials = service_account.Credentials.from_service_account_file(
+                SERVICE_ACCOUNT_FILE, scopes=["https://www.googleapis.com/auth/devstorage.read_write"])
+            session = AuthorizedSession(credentials)
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=STORAGE_UPLOAD_CONCURRENCY))
+            client = storage.Client(credentials=credentials, project=PROJECT_NAME, _http=session)
+            self._bucket = client.bucket(BUCKET_NAME)
+        return self._bucket
+
+    def upload(self, source_file, blob_name, content_type=None):
+        # large files go through a chunked, resumable upload so a failed request only resends the current chunk
+        source_file.seek(0, os.SEEK_END)
+        size = source_file.tell()
+        source_file.seek(0)
+        blob = self.bucket.blob(blob_name, chunk_size=UPLOAD_CHUNK_SIZE if size > UPLOAD_CHUNK_SIZE else None)
+
+        return blob.upload_from_file(source_file, content_type=content_type)
+
+    def download(self, blob_name, destination_file):
+        return self.bucket.blob(blob_name).download_to_file(destination_file)
+
+    def delete(self, blob_name):
+        try:
+            self.bucket.blob(blob_name).delete()
+        except NotFound:
+            pass
+
+    def exists(self, blob_name):
+        return self.bucket.blob(blob_name).exists()
+
+    def signed_url(self, blob_name, expiration):
+        return self.bucket.blob(blob_name).generate_signed_url(version="v4", expiration=expiration, method="GET")
@@ -0,0 +1,62 @@
+# local disk storage, used for development, tests and benchmarks instead of google cloud
+
+import mmap
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from ..storage import StorageBackend
+
+load_dotenv()
+
+# env variables
+LOCAL_STORAGE_PATH = os.getenv('LOCAL_STORAGE_PATH', 'storage')
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores each blob as a file under root, blob name '/' separators become directories.
+    Downloads are served from a memory map of the file instead of reading it into a buffer first
+    """
+
+    def __init__(self, root=LOCAL_STORAGE_PATH):
+        self.root = Path(root).resolve()
+
+    def _path(self, blob_name):
+        path = (self.root / blob_name).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid blob name {blob_name}")
+        return path
+
+    def upload(self, source_file, blob_name, content_type=None):
+        path = self._path(blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        source_file.seek(0)
+        # write next to the target and rename, readers never see a partially written blob
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            try:
+                shutil.copyfileobj(source_file, f)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def download(self, blob_name, destination_file):
+        with open(self._path(blob_name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                destination_file.write(mapped)
+
+    def delete(self, blob_name):
+        self._path(blob_name).unlink(missing_ok=True)
+
+    def exists(self, blob_name):
+        return self._path(blob_name).is_file()
+
+    def signed_url(self, blob_name, expiration):
+        # local files need no signature, the file URI is valid for as long as the file exists
+        return self._path(blob_name).as_uri()
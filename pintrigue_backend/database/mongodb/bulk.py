@@ -0,0 +1,59 @@
+# batched inserts, shared by the pymongo and motor db modules
+
+import os
+
+from dotenv import load_dotenv
+from pymongo import WriteConcern
+
+load_dotenv()
+
+# env variables
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+# acknowledgement batched inserts wait for, e.g. majority or 1
+BULK_WRITE_CONCERN = os.getenv("BULK_WRITE_CONCERN", "majority")
+
+
+def bulk_write_concern():
+    """
+    :return: the WriteConcern of batched inserts, BULK_WRITE_CONCERN as a number of nodes or a tag like majority
+    """
+    w = BULK_WRITE_CONCERN
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+
+def prepare_documents(items, build):
+    """
+    Build the document of every item of a batch. Items build raises ValueError, KeyError or TypeError for (e.g. an
+    invalid pin_id) are reported instead of inserted
+    :param items:
+    :param build: function turning one item into its document
+    :return: (documents, position of each document in items, errors)
+    """
+    documents, positions, errors = [], [], []
+    for position, item in enumerate(items):
+        try:
+            documents.append(build(item))
+            positions.append(position)
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append({"index": position, "error": str(e)})
+    return documents, positions, errors
+
+
+def insert_report(documents, positions, errors, bulk_error=None):
+    """
+    Result of an unordered insert_many, with the position in the batch of every item that was not inserted
+    :param documents: the documents passed to insert_many
+    :param positions: position of each document in the batch
+    :param errors: items rejected before the insert
+    :param bulk_error: BulkWriteError raised by insert_many, if any
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    details = bulk_error.details if bulk_error is not None else {}
+    write_errors = details.get("writeErrors", [])
+    errors = errors + [{"index": positions[error["index"]], "error": error["errmsg"]} for error in write_errors]
+    errors += [{"index": None, "error": error["errmsg"]} for error in details.get("writeConcernErrors", [])]
+    return {
+        "success": True,
+        "inserted": len(documents) - len(write_errors),
+        "errors": sorted(errors, key=lambda error: -1 if error["index"] is None else error["index"])
+    }
@@ -0,0 +1,83 @@
+# shared mongodb client
+
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from pymongo import MongoClient
+
+load_dotenv()
+
+"""
+Mongodb connection set up, one client (and connection pool) per process shared by every db_* module
+"""
+
+PINTRIGUE_DB_URI = os.getenv("PINTRIGUE_DB_URI")
+PINTRIGUE_DB_NAME = os.getenv("PINTRIGUE_DB_NAME")
+
+# pool sizing and timeouts
+PINTRIGUE_DB_MAX_POOL_SIZE = int(os.getenv("PINTRIGUE_DB_MAX_POOL_SIZE", 100))
+PINTRIGUE_DB_MIN_POOL_SIZE = int(os.getenv("PINTRIGUE_DB_MIN_POOL_SIZE", 0))
+PINTRIGUE_DB_MAX_IDLE_TIME_MS = int(os.getenv("PINTRIGUE_DB_MAX_IDLE_TIME_MS", 60000))
+PINTRIGUE_DB_CONNECT_TIMEOUT_MS = int(os.getenv("PINTRIGUE_DB_CONNECT_TIMEOUT_MS", 5000))
+PINTRIGUE_DB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("PINTRIGUE_DB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+PINTRIGUE_DB_W_TIMEOUT_MS = int(os.getenv("PINTRIGUE_DB_W_TIMEOUT_MS", 2500))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client_options():
+    """
+    Keyword arguments used to build the client, shared with any other driver pointed at the same database
+    :return:
+    """
+    return {
+        "uuidRepresentation": "standard",
+        "maxPoolSize": PINTRIGUE_DB_MAX_POOL_SIZE,
+        "minPoolSize": PINTRIGUE_DB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": PINTRIGUE_DB_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": PINTRIGUE_DB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": PINTRIGUE_DB_SERVER_SELECTION_TIMEOUT_MS,
+        "wTimeoutMS": PINTRIGUE_DB_W_TIMEOUT_MS,
+    }
+
+
+def get_client():
+    """
+    Return the process wide client, building it on first use
+    :return:
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(PINTRIGUE_DB_URI, **client_options())
+    return _client
+
+
+def get_db():
+    """
+    Return the pintrigue database on the shared client
+    :return:
+    """
+    return get_client()[PINTRIGUE_DB_NAME]
+
+
+def open_client():
+    """
+    Build the client and check the server is reachable, called on app start up
+    """
+    get_client().admin.command("ping")
+
+
+def close_client():
+    """
+    Close the shared client and its pool, called on app shut down
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
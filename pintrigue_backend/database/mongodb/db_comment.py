@@ -1,37 +1,22 @@
 # mongodb comment database functions
 
-import os
 from datetime import datetime
 from random import choice
-
-from dotenv import load_dotenv
 from uuid import uuid4, UUID
 
-from pymongo import MongoClient, WriteConcern, ASCENDING, DESCENDING
-from pymongo.errors import DuplicateKeyError
+from pymongo import WriteConcern, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 
-load_dotenv()
-
-"""
-Mongodb database set up
-"""
-
-PINTRIGUE_DB_URI = os.getenv("PINTRIGUE_DB_URI")
-PINTRIGUE_DB_NAME = os.getenv("PINTRIGUE_DB_NAME")
-
-db = MongoClient(
-    PINTRIGUE_DB_URI,
-    uuidRepresentation='standard',
-    maxPoolSize=100,
-    wTimeoutMS=2500
-)[PINTRIGUE_DB_NAME]
+from ..cache import pin_cache, pin_cache_key
+from .bulk import bulk_write_concern, prepare_documents, insert_report
+from .client import get_db
+from .indexes import COMMENT_FEED_INDEX
+from .pagination import keyset_filter, next_page
 
 """
 Comment collection
 """
 
-comments = db.comments  # comments collection
-
 
 def create_comment(pin_id, posted_by, comment):
     print(f"Received comment data: {pin_id} - {posted_by} - {comment}")
@@ -45,7 +30,7 @@ def create_comment(pin_id, posted_by, comment):
     uuid_object = uuid4()
 
     try:
-        db.comments.insert_one(
+        get_db().comments.insert_one(
             {
                 "comment_id": uuid_object,
                 "pin_id": UUID(pin_id),
@@ -54,11 +39,51 @@ def create_comment(pin_id, posted_by, comment):
                 "created_at": datetime.utcnow()
             }, WriteConcern(w="majority")  # durable writes
         )
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
 
 
+def comment_document(item):
+    """
+    Comment document for one item of a batch
+    :param item: {"pin_id", "posted_by", "comment"}
+    :return:
+    """
+    return {
+        "comment_id": uuid4(),
+        "pin_id": UUID(item["pin_id"]),
+        "posted_by": item["posted_by"],
+        "comment": item["comment"],
+        "created_at": datetime.utcnow()
+    }
+
+
+def create_comments(comments):
+    """
+    Insert a batch of comments with one unordered insert_many, acknowledged with the BULK_WRITE_CONCERN.
+    A failed item doesn't stop the others
+    :param comments: list of {"pin_id", "posted_by", "comment"}
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    documents, positions, errors = prepare_documents(comments, comment_document)
+    if not documents:
+        return insert_report(documents, positions, errors)
+
+    try:
+        get_db().comments.with_options(write_concern=bulk_write_concern()).insert_many(documents, ordered=False)
+        report = insert_report(documents, positions, errors)
+    except BulkWriteError as e:
+        report = insert_report(documents, positions, errors, e)
+    except Exception as e:
+        return {"error": e}
+
+    for pin_id in {document["pin_id"] for document in documents}:
+        pin_cache().delete(pin_cache_key(pin_id))
+    return report
+
+
 def update_comment(comment_id, comment):
     """
     With the given information, update a comment on a pin
@@ -66,12 +91,15 @@ def update_comment(comment_id, comment):
     :param comment:
     """
     try:
-        db.comments.update_one(
+        updated = get_db().comments.find_one_and_update(
             {
                 "comment_id": UUID(comment_id)
             },
-            {"$set": {"comment": comment, "date": datetime.utcnow()}}
+            {"$set": {"comment": comment, "date": datetime.utcnow()}},
+            projection={"_id": 0, "pin_id": 1}
         )
+        if updated:
+            pin_cache().delete(pin_cache_key(updated["pin_id"]))
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -83,20 +111,40 @@ def delete_comment(comment_id):
     :param comment_id:
     """
     try:
-        db.comments.delete_one(
+        deleted = get_db().comments.find_one_and_delete(
             {
                 "comment_id": UUID(comment_id)
-            }
+            },
+            projection={"_id": 0, "pin_id": 1}
         )
+        if deleted:
+            pin_cache().delete(pin_cache_key(deleted["pin_id"]))
         return {"success": True}
     except Exception as e:
         return {"error": e}
 
 
+def get_comments_by_pin(pin_id, comments_per_page, cursor=None):
+    """
+    Page through the comments of a pin newest first, with a range query on the (pin_id, created_at, comment_id) index.
+    Raises ValueError for an invalid pin_id or cursor
+    :param pin_id:
+    :param comments_per_page:
+    :param cursor: next_cursor of the previous page, or a pin's next_comments_cursor
+    :return: (comments, next_cursor)
+    """
+    query = {"pin_id": UUID(pin_id)}
+    if cursor is not None:
+        query.update(keyset_filter(cursor, "comment_id"))
+    comments = get_db().comments.find(query, {"_id": 0}, hint=COMMENT_FEED_INDEX) \
+        .sort(COMMENT_FEED_INDEX[1:]).limit(comments_per_page + 1)
+    return next_page(list(comments), comments_per_page, "comment_id")
+
+
 # for testing purposes only
 def get_random_comment():
     list_of_comments = []
-    cursor = db.comments.find({}, {"_id": 0})
+    cursor = get_db().comments.find({}, {"_id": 0})
     for document in cursor:
         list_of_comments.append(document)
     return choice(list_of_comments)
@@ -104,4 +152,5 @@ def get_random_comment():
 
 # for testing purposes only
 def get_comment(pin_id, posted_by, comment):
-    return db.comments.find_one({"pin_id": UUID(pin_id), "posted_by": posted_by, "comment": comment}, {"_id": 0})
+    return get_db().comments.find_one({"pin_id": UUID(pin_id), "posted_by": posted_by, "comment": comment},
+                                      {"_id": 0})
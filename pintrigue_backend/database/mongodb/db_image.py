@@ -0,0 +1,55 @@
+# mongodb image database functions
+
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from .client import get_db
+
+"""
+Image collection, maps the content hash of an upload to the blobs it was stored as
+"""
+
+
+def get_image_by_hash(sha256):
+    """
+    Look up a stored image by the SHA-256 of the uploaded bytes
+    :param sha256:
+    :return:
+    """
+    return get_db().images.find_one({"sha256": sha256}, {"_id": 0})
+
+
+def get_image_by_phash(phash):
+    """
+    Look up a stored image by perceptual hash, i.e. a near duplicate of the upload
+    :param phash:
+    :return:
+    """
+    return get_db().images.find_one({"phash": phash}, {"_id": 0})
+
+
+def add_image(sha256, phash, image_id, image_variants):
+    """
+    Record where the variants of an upload were stored, so the same upload is never converted or stored again
+    :param sha256:
+    :param phash:
+    :param image_id:
+    :param image_variants:
+    """
+    try:
+        get_db().images.insert_one(
+            {
+                "sha256": sha256,
+                "phash": phash,
+                "image_id": image_id,
+                "image_variants": image_variants,
+                "created_at": datetime.utcnow()
+            }
+        )
+        return {"success": True}
+    except DuplicateKeyError:
+        # the same upload was stored concurrently, its blobs have the same names
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
@@ -1,39 +1,30 @@
 import os
 from datetime import datetime
 from random import choice
-
-from dotenv import load_dotenv
 from uuid import uuid4, UUID
 
-from pymongo import MongoClient, WriteConcern, ASCENDING, DESCENDING
+from dotenv import load_dotenv
+from pymongo import WriteConcern, ASCENDING, DESCENDING
 from pymongo.errors import DuplicateKeyError
 
-load_dotenv()
-
-"""
-Mongodb database set up
-"""
-
-PINTRIGUE_DB_URI = os.getenv("PINTRIGUE_DB_URI")
-PINTRIGUE_DB_NAME = os.getenv("PINTRIGUE_DB_NAME")
+from pintrigue_backend.schemas.schemas import PinCard
+from ..cache import pin_cache, pin_cache_key, pin_count_cache, pin_count_key
+from .client import get_db
+from .indexes import PIN_FEED_INDEX, PIN_CATEGORY_FEED_INDEX, PIN_POSTED_BY_FEED_INDEX
+from .pagination import encode_cursor, keyset_filter, score_keyset_filter, next_page
 
-db = MongoClient(
-    PINTRIGUE_DB_URI,
-    uuidRepresentation='standard',
-    maxPoolSize=100,
-    wTimeoutMS=2500
-)[PINTRIGUE_DB_NAME]
+load_dotenv()
 
+# comments included in a pin's detail, newest first
+PIN_DETAIL_COMMENTS = int(os.getenv("PIN_DETAIL_COMMENTS", 20))
 
 """
 Pin collection
 """
 
-pins = db.pins  # pins collection
-
 
 # create a pin
-def create_pin(title, about, category, image_id, posted_by):
+def create_pin(title, about, category, image_id, posted_by, image_variants=None):
     print(f"Pin information received: Title: {title} - About: {about} - Category: {category} - Image ID: {image_id} - \
     Posted By: {posted_by}")
 
@@ -46,12 +37,13 @@ def create_pin(title, about, category, image_id, posted_by):
     :param category:
     :param image_id:
     :param posted_by:
+    :param image_variants: responsive sizes/formats of the image, [{"url", "width", "height", "format"}]
     """
 
     uuid_object = uuid4()
 
     try:
-        db.pins.insert_one(
+        get_db().pins.insert_one(
             {
                 "pin_id": uuid_object,
                 "created_at": datetime.utcnow(),
@@ -59,81 +51,238 @@ def create_pin(title, about, category, image_id, posted_by):
                 "about": about,
                 "category": category,
                 "image_id": image_id,
+                "image_variants": image_variants or [],
                 "posted_by": posted_by,
                 "comments": []
             }, WriteConcern(w="majority")
         )
+        increment_category_count(category, 1)
+        adjust_pin_counts(1, category=category, posted_by=posted_by)
         # create_posted_by(posted_by)
         return {"success": True}
     except Exception as e:
         return {"error": e}
 
 
+# fields pins are listed with in feed grids, a field added to schemas.PinCard is fetched for every listing
+PIN_CARD_FIELDS = list(PinCard.__fields__)
+# every field a listing can ask for with a sparse fieldset
+PIN_FIELDS = PIN_CARD_FIELDS + ["about", "comments"]
+
+
+def pin_projection(fields=None):
+    """
+    Projection returning only the given fields of a pin, the PinCard fields by default.
+    pin_id and created_at are always included, paging cursors are built from them.
+    Raises ValueError for a field pins don't have
+    :param fields:
+    :return:
+    """
+    fields = fields or PIN_CARD_FIELDS
+    unknown = [field for field in fields if field not in PIN_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown pin fields {', '.join(unknown)}")
+    return {"_id": 0, "pin_id": 1, "created_at": 1, **{field: 1 for field in fields}}
+
+
 def query_sort_project(filters):
     """
-    Using filter, use this function to build a query
+    Using filter, use this function to build a query. Every given filter is applied:
+    text - $text search
+    category, posted_by - one value or a list of values
+    created_after, created_before - datetime range on created_at
+    The hint is the compound index whose equality field narrows the query most, None for text searches which
+    always use the text index
     :param filters:
-    :return:
+    :return: (query, sort, hint)
     """
 
     query = {}
-    sort = [("pin_id", DESCENDING)]
+    sort = PIN_FEED_INDEX
+    hint = PIN_FEED_INDEX
 
     if filters:
-        if "text" in filters:
-            query = {"$text": {"$search": filters["text"]}}
-        elif "category" in filters:
-            query = {"category": {"$in": [filters["category"]]}}
-        elif "posted_by" in filters:
-            query = {"posted_by": {"$in": [filters["posted_by"]]}}
-    return query, sort
+        if filters.get("text"):
+            query["$text"] = {"$search": filters["text"]}
+        for field in ("category", "posted_by"):
+            values = filters.get(field)
+            if values:
+                query[field] = {"$in": values if isinstance(values, (list, tuple)) else [values]}
+        created_at = {}
+        if filters.get("created_after"):
+            created_at["$gte"] = filters["created_after"]
+        if filters.get("created_before"):
+            created_at["$lt"] = filters["created_before"]
+        if created_at:
+            query["created_at"] = created_at
+
+    if "$text" in query:
+        hint = None
+    elif "posted_by" in query:
+        hint = PIN_POSTED_BY_FEED_INDEX
+    elif "category" in query:
+        hint = PIN_CATEGORY_FEED_INDEX
+    return query, sort, hint
+
+
+def count_pins(query, hint_option):
+    """
+    Total for a pin listing. The unfiltered total is read from the collection metadata, filtered totals are cached
+    for PIN_COUNT_CACHE_TTL seconds and adjusted as pins are created and deleted
+    :param query:
+    :param hint_option:
+    :return:
+    """
+    if not query:
+        return get_db().pins.estimated_document_count()
+
+    cache = pin_count_cache()
+    key = pin_count_key(query)
+    total = cache.get(key)
+    if total is None:
+        total = get_db().pins.count_documents(query, **hint_option)
+        cache.set(key, total)
+    return total
+
+
+def adjust_pin_counts(amount, category=None, posted_by=None):
+    """
+    Keep the cached totals of the single category and posted_by listings right after a pin write, other filter
+    combinations catch up when their entry expires
+    :param amount:
+    :param category:
+    :param posted_by:
+    """
+    for field, value in (("category", category), ("posted_by", posted_by)):
+        if value is not None:
+            pin_count_cache().incr(pin_count_key(query_sort_project({field: value})[0]), amount)
 
 
 # function to enable paging for pins
-def get_pins(filters, page, pins_per_page):
-    query, sort = query_sort_project(filters)
-    cursor = db.pins.find(query, {"_id": 0}).sort(sort)
+def get_pins(filters, page, pins_per_page, cursor=None, projection=None):
+    """
+    Page through pins newest first.
+    With a cursor (the next_cursor of the previous page) the page is fetched with a range query on the
+    (created_at, pin_id) index so every page costs the same; without one, page * pins_per_page documents are skipped
+    :param filters:
+    :param page:
+    :param pins_per_page:
+    :param cursor:
+    :param projection: pin_projection of the fields to return, every field by default
+    :return: (pins, total_num_pins, next_cursor)
+    """
+    query, sort, hint = query_sort_project(filters)
+    projection = projection or {"_id": 0}
+    hint_option = {"hint": hint} if hint else {}
 
     total_num_pins = 0
-    if page == 0:
-        total_num_pins = db.pins.count_documents(query)
+    if page == 0 and cursor is None:
+        total_num_pins = count_pins(query, hint_option)
+
+    if cursor is not None:
+        keyset = keyset_filter(cursor, "pin_id")
+        query = {"$and": [query, keyset]} if query else keyset
+        fetched_pins = get_db().pins.find(query, projection, **hint_option).sort(sort).limit(pins_per_page + 1)
+    else:
+        fetched_pins = get_db().pins.find(query, projection, **hint_option).sort(sort) \
+            .skip(int(page * pins_per_page)).limit(pins_per_page + 1)
 
-    fetched_pins = cursor.skip(int(page * pins_per_page)).limit(pins_per_page)
+    fetched_pins, next_cursor = next_page(list(fetched_pins), pins_per_page, "pin_id")
+    return fetched_pins, total_num_pins, next_cursor
 
-    return list(fetched_pins), total_num_pins
+
+def text_search_pipeline(text, filters, pins_per_page, cursor=None, projection=None):
+    """
+    Pipeline for one page of pins matching text, most relevant first (textScore, then newest first).
+    category and posted_by filters are matched together with $text so the text index does the work
+    :param text:
+    :param filters:
+    :param pins_per_page:
+    :param cursor: next_cursor of the previous page
+    :param projection: pin_projection of the fields to return, every field by default
+    :return:
+    """
+    match = {"$text": {"$search": text}}
+    for field in ("category", "posted_by"):
+        if filters and filters.get(field):
+            match[field] = filters[field]
+
+    pipeline = [
+        {
+            '$match': match
+        }, {
+            '$addFields': {
+                'score': {'$meta': 'textScore'}
+            }
+        }
+    ]
+    if cursor is not None:
+        pipeline.append({'$match': score_keyset_filter(cursor, "pin_id")})
+    pipeline += [
+        {
+            '$sort': {
+                'score': -1, 'created_at': -1, 'pin_id': -1
+            }
+        }, {
+            '$limit': pins_per_page + 1
+        }, {
+            '$project': {**projection, 'score': 1} if projection else {'_id': 0}
+        }
+    ]
+    return pipeline
+
+
+def search_pins(text, filters, pins_per_page, cursor=None, projection=None):
+    """
+    Full text search over pin titles, categories and abouts, ranked by relevance and paged with a cursor.
+    Raises ValueError for a cursor that was not returned by search_pins
+    :param text:
+    :param filters: optional category and posted_by
+    :param pins_per_page:
+    :param cursor:
+    :param projection:
+    :return: (pins, next_cursor), each pin with its relevance score
+    """
+    pins = list(get_db().pins.aggregate(text_search_pipeline(text, filters, pins_per_page, cursor, projection)))
+    return next_page(pins, pins_per_page, "pin_id", score_field="score")
 
 
 # search function primarily used for the auto-complete search feature
 def get_all_pins():
     list_of_pins = []
-    cursor = pins.find({}, {"_id": 0, "comments": 0, "image_id": 0})
+    cursor = get_db().pins.find({}, {"_id": 0, "comments": 0, "image_id": 0})
     for document in cursor:
         list_of_pins.append(document)
     return list_of_pins
 
 
-def get_pins_by_category(categories):
+# fields get_pins_by_category returns when no projection is given
+CATEGORY_PIN_PROJECTION = {"title": 1, "posted_by": 1, "image_id": 1, "_id": 0}
+
+
+def get_pins_by_category(categories, projection=None):
     try:
-        return list(db.pins.find({"category": {"$in": [categories]}}, {"title": 1, "posted_by": 1, "image_id": 1,
-                                                                       "_id": 0}))
+        return list(get_db().pins.find({"category": {"$in": [categories]}}, projection or CATEGORY_PIN_PROJECTION))
     except Exception as e:
         return {"Error": e}
 
 
 def get_pin(title, posted_by):
-    return db.pins.find_one(
+    return get_db().pins.find_one(
         {"posted_by": posted_by, "title": title},
         {"_id": 0}
     )
 
 
-def get_pin_by_id(pin_id):
+def pin_with_comments_pipeline(pin_id):
     """
-    Using a pipeline, join two collections to get a pin and the comments associated with it
+    Pipeline joining a pin with its newest PIN_DETAIL_COMMENTS comments and the number of comments it has.
+    Both lookups run on the comments (pin_id, created_at, comment_id) index, the rest of the comments are paged with
+    get_comments_by_pin
     :param pin_id:
+    :return:
     """
-
-    pipeline = [
+    return [
         {
             '$match': {
                 'pin_id': UUID(pin_id)
@@ -153,6 +302,12 @@ def get_pin_by_id(pin_id):
                                 ]
                             }
                         }
+                    }, {
+                        '$sort': {
+                            'created_at': -1, 'comment_id': -1
+                        }
+                    }, {
+                        '$limit': PIN_DETAIL_COMMENTS
                     }, {
                         '$project': {
                             '_id': 0
@@ -162,8 +317,31 @@ def get_pin_by_id(pin_id):
                 'as': 'comments'
             }
         }, {
-            '$sort': {
-                'created_at': -1
+            '$lookup': {
+                'from': 'comments',
+                'let': {
+                    'pin_id': '$pin_id'
+                },
+                'pipeline': [
+                    {
+                        '$match': {
+                            '$expr': {
+                                '$eq': [
+                                    '$pin_id', '$$pin_id'
+                                ]
+                            }
+                        }
+                    }, {
+                        '$count': 'count'
+                    }
+                ],
+                'as': 'comment_count'
+            }
+        }, {
+            '$addFields': {
+                'comment_count': {
+                    '$ifNull': [{'$arrayElemAt': ['$comment_count.count', 0]}, 0]
+                }
             }
         }, {
             '$project': {
@@ -172,24 +350,43 @@ def get_pin_by_id(pin_id):
         }
     ]
 
-    pin = db.pins.aggregate(pipeline).next()
+
+def with_comments_cursor(pin):
+    """
+    Add the cursor get_comments_by_pin continues from after the comments included in a pin, None when it has them all
+    :param pin:
+    :return:
+    """
+    comments = pin.get("comments") or []
+    pin["next_comments_cursor"] = None
+    if pin.get("comment_count", 0) > len(comments):
+        pin["next_comments_cursor"] = encode_cursor(comments[-1]["created_at"], comments[-1]["comment_id"])
     return pin
 
 
-def get_popular_pin_categories(limit):
+def get_pin_by_id(pin_id):
+    """
+    Using a pipeline, join two collections to get a pin with its newest comments and comment count.
+    Read through the pin cache, pin and comment writes invalidate the entry
+    :param pin_id:
     """
-    This function returns the top 8 most created pin categories
+
+    cache = pin_cache()
+    key = pin_cache_key(pin_id)
+    pin = cache.get(key)
+    if pin is None:
+        pin = with_comments_cursor(get_db().pins.aggregate(pin_with_comments_pipeline(pin_id)).next())
+        cache.set(key, pin)
+    return pin
+
+
+def category_counts_pipeline():
+    """
+    Pipeline recounting pins per category from scratch and replacing the category_counts collection with the result
     :return:
     """
-    pipeline = [
+    return [
         {
-            '$project': {
-                'category': 1,
-                'image_id': 1,
-                'posted_by': 1,
-                '_id': 0
-            }
-        }, {
             '$group': {
                 '_id': '$category',
                 'totalPins': {
@@ -197,15 +394,43 @@ def get_popular_pin_categories(limit):
                 }
             }
         }, {
-            '$sort': {
-                'totalPins': -1
-            }
-        }, {
-            '$limit': limit
+            '$out': 'category_counts'
         }
     ]
-    pin = list(db.pins.aggregate(pipeline))
-    return pin
+
+
+def popular_categories_query(limit):
+    """
+    (filter, sort, limit) reading the most created categories from category_counts
+    :param limit:
+    :return:
+    """
+    return {"totalPins": {"$gt": 0}}, [("totalPins", DESCENDING)], limit
+
+
+def get_popular_pin_categories(limit):
+    """
+    This function returns the top 8 most created pin categories, read from the counts maintained on every pin write
+    :return:
+    """
+    query, sort, limit = popular_categories_query(limit)
+    return list(get_db().category_counts.find(query).sort(sort).limit(limit))
+
+
+def increment_category_count(category, amount):
+    """
+    Adjust the number of pins in a category, called after a pin is created, deleted or moved between categories
+    :param category:
+    :param amount:
+    """
+    get_db().category_counts.update_one({"_id": category}, {"$inc": {"totalPins": amount}}, upsert=True)
+
+
+def reconcile_category_counts():
+    """
+    Recount every category from the pins collection, repairing drift from failed or racing increments
+    """
+    get_db().pins.aggregate(category_counts_pipeline())
 
 
 def update_pin_title(pin_id, title):
@@ -215,12 +440,13 @@ def update_pin_title(pin_id, title):
     :param title:
     """
     try:
-        db.pins.update_one(
+        get_db().pins.update_one(
             {
                 "pin_id": UUID(pin_id)
             },
             {"$set": {"title": title}}
         )
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -233,12 +459,13 @@ def update_pin_about(pin_id, about):
     :param about:
     """
     try:
-        db.pins.update_one(
+        get_db().pins.update_one(
             {
                 "pin_id": UUID(pin_id)
             },
             {"$set": {"about": about}}
         )
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -252,30 +479,39 @@ def update_pin_category(pin_id, category):
     """
 
     try:
-        db.pins.update_one(
+        previous = get_db().pins.find_one_and_update(
             {
                 "pin_id": UUID(pin_id)
             },
-            {"$set": {"category": category}}
+            {"$set": {"category": category}},
+            projection={"_id": 0, "category": 1}
         )
+        if previous and previous.get("category") != category:
+            increment_category_count(previous.get("category"), -1)
+            increment_category_count(category, 1)
+            adjust_pin_counts(-1, category=previous.get("category"))
+            adjust_pin_counts(1, category=category)
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
 
 
-def update_pin_image(pin_id, image_id):
+def update_pin_image(pin_id, image_id, image_variants=None):
     """
     Update a image of a pin
     :param pin_id:
     :param image_id:
+    :param image_variants:
     """
     try:
-        db.pins.update_one(
+        get_db().pins.update_one(
             {
                 "pin_id": UUID(pin_id)
             },
-            {"$set": {"image_id": image_id}}
+            {"$set": {"image_id": image_id, "image_variants": image_variants or []}}
         )
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -283,9 +519,14 @@ def update_pin_image(pin_id, image_id):
 
 def delete_pin(pin_id):
     try:
-        db.pins.delete_one(
-            {"pin_id": UUID(pin_id)}
+        deleted = get_db().pins.find_one_and_delete(
+            {"pin_id": UUID(pin_id)},
+            projection={"_id": 0, "category": 1, "posted_by": 1}
         )
+        if deleted:
+            increment_category_count(deleted.get("category"), -1)
+            adjust_pin_counts(-1, category=deleted.get("category"), posted_by=deleted.get("posted_by"))
+        pin_cache().delete(pin_cache_key(pin_id))
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -294,7 +535,7 @@ def delete_pin(pin_id):
 # for testing purposes only
 def get_random_pin():
     list_of_pins = []
-    cursor = db.pins.find({}, {"_id": 0})
+    cursor = get_db().pins.find({}, {"_id": 0})
     for document in cursor:
         list_of_pins.append(document)
     return choice(list_of_pins)
\ No newline at end of file
@@ -1,37 +1,19 @@
 # mongodb database save functions
 
-import os
 from datetime import datetime
 from random import choice
-
-from dotenv import load_dotenv
 from uuid import uuid4, UUID
 
-from pymongo import MongoClient, WriteConcern, ASCENDING, DESCENDING
-from pymongo.errors import DuplicateKeyError
-
-load_dotenv()
-
-"""
-Mongodb database set up
-"""
-
-PINTRIGUE_DB_URI = os.getenv("PINTRIGUE_DB_URI")
-PINTRIGUE_DB_NAME = os.getenv("PINTRIGUE_DB_NAME")
+from pymongo import WriteConcern, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 
-db = MongoClient(
-    PINTRIGUE_DB_URI,
-    uuidRepresentation='standard',
-    maxPoolSize=100,
-    wTimeoutMS=2500
-)[PINTRIGUE_DB_NAME]
+from .bulk import bulk_write_concern, prepare_documents, insert_report
+from .client import get_db
 
 """
 Save collection
 """
 
-saves = db.saves  # saves collection
-
 
 def add_save(posted_by, user_id):
     """
@@ -45,7 +27,7 @@ def add_save(posted_by, user_id):
     uuid_object = uuid4()
 
     try:
-        db.saves.insert_one(
+        get_db().saves.insert_one(
             {
                 "save_id": uuid_object,
                 "posted_by": posted_by,
@@ -57,13 +39,46 @@ def add_save(posted_by, user_id):
         return {"error": e}
 
 
+def save_document(item):
+    """
+    Save document for one item of a batch
+    :param item: {"posted_by", "user_id"}
+    :return:
+    """
+    return {
+        "save_id": uuid4(),
+        "posted_by": item["posted_by"],
+        "user_id": item["user_id"]
+    }
+
+
+def add_saves(saves):
+    """
+    Insert a batch of saves with one unordered insert_many, acknowledged with the BULK_WRITE_CONCERN.
+    A failed item doesn't stop the others
+    :param saves: list of {"posted_by", "user_id"}
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    documents, positions, errors = prepare_documents(saves, save_document)
+    if not documents:
+        return insert_report(documents, positions, errors)
+
+    try:
+        get_db().saves.with_options(write_concern=bulk_write_concern()).insert_many(documents, ordered=False)
+        return insert_report(documents, positions, errors)
+    except BulkWriteError as e:
+        return insert_report(documents, positions, errors, e)
+    except Exception as e:
+        return {"error": e}
+
+
 def remove_save(save_id):
     """
     Remove a save from collection
     :param save_id:
     """
 
-    response = db.saves.delete_one(
+    response = get_db().saves.delete_one(
         {
             "save_id": UUID(save_id),
         }
@@ -1,65 +1,90 @@
 # mongodb database functions
 
-import os
+import re
 from datetime import datetime
 from random import choice
-
-from dotenv import load_dotenv
 from uuid import uuid4, UUID
 
-from pymongo import MongoClient, WriteConcern, ASCENDING, DESCENDING
+from pymongo import WriteConcern, ASCENDING, DESCENDING
 from pymongo.errors import DuplicateKeyError
 
-load_dotenv()
+from ..cache import user_cache, session_cache, user_cache_key
+from .client import get_db
 
 """
-Mongodb database set up
+User collection
 """
 
-PINTRIGUE_DB_URI = os.getenv("PINTRIGUE_DB_URI")
-PINTRIGUE_DB_NAME = os.getenv("PINTRIGUE_DB_NAME")
 
-db = MongoClient(
-    PINTRIGUE_DB_URI,
-    uuidRepresentation='standard',
-    maxPoolSize=100,
-    wTimeoutMS=2500
-)[PINTRIGUE_DB_NAME]
+def login(user_id, jti, expires_at):
+    """
+    Creates an entry in the sessions collection on sign in, one per access token, and drops the cached user.
+    The TTL index on expires_at removes it once the token has expired
+    :param user_id:
+    :param jti: id of the access token
+    :param expires_at: expiry of the access token
+    :return:
+    """
+    try:
+        get_db().sessions.insert_one(
+            {
+                "jti": jti,
+                "user_id": UUID(str(user_id)),
+                "created_at": datetime.utcnow(),
+                "expires_at": expires_at
+            }
+        )
+        # a fresh sign in reads the user from the db again, it won't be served a copy cached before it
+        user_cache().delete(user_cache_key(user_id))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
 
-"""
-User collection
-"""
 
-users = db.users  # users collection
-sessions = db.sessions  # sessions collection, used to handle sessions when a user signs in
+def verify_active_session(jti):
+    """
+    Whether the access token with this id was issued by login and has not been revoked or expired.
+    Cached for SESSION_CACHE_TTL seconds, so a session revoked through another worker is refused within that time
+    :param jti:
+    :return:
+    """
+    cache = session_cache()
+    active = cache.get(jti)
+    if active is None:
+        session = get_db().sessions.find_one({"jti": jti}, {"_id": 0, "expires_at": 1})
+        active = session is not None and session["expires_at"] > datetime.utcnow()
+        cache.set(jti, active)
+    return active
 
 
-def login(user_id, jwt):
+def revoke_session(jti):
     """
-    Creates an entry in the sessions collection on sign in
-    :param user_id:
-    :param jwt:
+    Log an access token out
+    :param jti:
     :return:
     """
     try:
-        db.sessions.update_one(
-            {"user_id": UUID(user_id)},
-            {"$set": {"jwt": jwt}},
-            upsert=True
-        )
+        get_db().sessions.delete_one({"jti": jti})
+        session_cache().delete(jti)
         return {"success": True}
     except Exception as e:
         return {"error": e}
 
 
-def verify_active_session(user_id):
+def revoke_user_sessions(user_id):
+    """
+    Log every access token of a user out
+    :param user_id:
+    :return:
+    """
     try:
-        db.sessions.find_one(
-            {"user_id": UUID(user_id)}
-        )
+        jtis = get_db().sessions.distinct("jti", {"user_id": UUID(str(user_id))})
+        get_db().sessions.delete_many({"user_id": UUID(str(user_id))})
+        for jti in jtis:
+            session_cache().delete(jti)
         return {"success": True}
-    finally:
-        return {"success": False}
+    except Exception as e:
+        return {"error": e}
 
 
 # look up a single user
@@ -70,7 +95,7 @@ def get_user(username):
     :param username:
     :return:
     """
-    return db.users.find_one({'username': username}, {"_id": 0})
+    return get_db().users.find_one({'username': username}, {"_id": 0})
 
 
 # look up a user by email
@@ -80,12 +105,12 @@ def get_user_by_email(email):
     :param email:
     :return:
     """
-    return db.users.find_one({'email': email}, {"_id": 0})
+    return get_db().users.find_one({'email': email}, {"_id": 0})
 
 
 # look up a user by email
 def get_user_by_id(user_id):
-    return db.users.find_one({'user_id': UUID(user_id)}, {"_id": 0})
+    return get_db().users.find_one({'user_id': UUID(user_id)}, {"_id": 0})
 
 
 # look for all users in db
@@ -96,7 +121,7 @@ def get_all_users():
     :return:
     """
     list_of_users = []
-    cursor = users.find({}, {"_id": 0})
+    cursor = get_db().users.find({}, {"_id": 0})
     for document in cursor:
         list_of_users.append(document)
     return list_of_users
@@ -109,36 +134,66 @@ def get_user_id(username):
     :param username:
     :return:
     """
-    return db.users.find_one({'username': username}, {'_id': 0, "user_id": 1}).inserted_id
+    return get_db().users.find_one({'username': username}, {'_id': 0, "user_id": 1}).inserted_id
+
+
+def duplicate_key_field(error):
+    """
+    The field whose unique index a DuplicateKeyError was raised by
+    :param error:
+    :return: e.g. username or email, None when the server didn't say
+    """
+    details = error.details or {}
+    if details.get("keyPattern"):
+        return next(iter(details["keyPattern"]))
+    # servers before 4.2 only name the index in the message, e.g. "index: username_1 dup key"
+    match = re.search(r"index: (\w+?)_-?1", details.get("errmsg", str(error)))
+    return match.group(1) if match else None
+
+
+def user_document(name, username, email, hashedpw, image_id):
+    """
+    The users document of a new user
+    :param name:
+    :param username:
+    :param email:
+    :param hashedpw:
+    :param image_id:
+    :return:
+    """
+    return {
+        "user_id": uuid4(),
+        "name": name,
+        "email": email,
+        "username": username,
+        "password": hashedpw,
+        "image_id": image_id,
+    }
 
 
 # create a user
 def create_user(name, username, email, hashedpw, image_id):
     """
-    Take the following params and insert doc into the 'users' collection to create a user
+    Take the following params and insert doc into the 'users' collection to create a user.
+    The unique indexes on username and email reject duplicates, so this is the only round trip sign up makes
     :param image_id:
     :param email:
     :param name:
     :param username:
     :param hashedpw:
+    :return: {"success": True, "user": the inserted user without _id and password}, {"error", "field"} for a taken
+    username or email, or {"error"} when the insert failed otherwise
     """
-
-    uuid_object = uuid4()
+    document = user_document(name=name, username=username, email=email, hashedpw=hashedpw, image_id=image_id)
 
     try:
-        db.users.insert_one(
-            {
-                "user_id": uuid_object,
-                "name": name,
-                "email": email,
-                "username": username,
-                "password": hashedpw,
-                "image_id": image_id,
-            }, WriteConcern(w='majority')  # durable writes with majority WriteConcern
-        )
-        return {"success": True}
-    except DuplicateKeyError:
-        return {"error": "A user with the given email already exists."}
+        get_db().users.with_options(write_concern=WriteConcern(w='majority')).insert_one(document)  # durable writes
+    except DuplicateKeyError as e:
+        field = duplicate_key_field(e)
+        return {"error": f"A user with the given {field or 'details'} already exists.", "field": field}
+    except Exception as e:
+        return {"error": e}
+    return {"success": True, "user": {key: value for key, value in document.items() if key not in ("_id", "password")}}
 
 
 # update username
@@ -148,15 +203,20 @@ def update_username(user_id, current_username, new_username):
     :param user_id:
     :param current_username:
     :param new_username:
-    :return:
+    :return: {"success": True}, or {"error", "field"} when new_username is taken
     """
     print(f"Received info - {user_id} - {current_username} - {new_username}")
     try:
-        db.users.update_one(
+        get_db().users.update_one(
             {"user_id": UUID(user_id), "username": current_username},
             {"$set": {"username": new_username}}
         )
+        user_cache().delete(user_cache_key(user_id))
         return {"success": True}
+    except DuplicateKeyError as e:
+        # the unique username index refuses a name another user has
+        field = duplicate_key_field(e)
+        return {"error": f"A user with the given {field or 'details'} already exists.", "field": field}
     except Exception as e:
         return {"error": e}
 
@@ -170,10 +230,33 @@ def update_password(user_id, new_password):
     :return:
     """
     try:
-        db.users.update_one(
+        get_db().users.update_one(
             {"user_id": UUID(user_id)},
             {"$set": {"password": new_password}}
         )
+        user_cache().delete(user_cache_key(user_id))
+        revoke_user_sessions(user_id)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+# upgrade the hash of a password on login
+def rehash_password(user_id, old_password, new_password):
+    """
+    Replace a deprecated password hash with one of the same password, e.g. made with more bcrypt rounds.
+    Unlike update_password the sessions of the user stay valid, and a password changed since old_password was read
+    is left alone
+    :param user_id:
+    :param old_password: the hash the password was verified against
+    :param new_password: the new hash
+    :return:
+    """
+    try:
+        get_db().users.update_one(
+            {"user_id": UUID(str(user_id)), "password": old_password},
+            {"$set": {"password": new_password}}
+        )
         return {"success": True}
     except Exception as e:
         return {"error": e}
@@ -190,7 +273,9 @@ def delete_user(user_id, email):
     """
 
     try:
-        db.users.delete_one({"user_id": UUID(user_id), "email": email})
+        get_db().users.delete_one({"user_id": UUID(user_id), "email": email})
+        user_cache().delete(user_cache_key(user_id))
+        revoke_user_sessions(user_id)
 
         # check if the user exists in 'users' collection to confirm delete was successful
         if get_user(email) is None:
@@ -0,0 +1,237 @@
+# index declarations for every collection, created at start up or from the command line
+
+import argparse
+import logging
+import sys
+from uuid import uuid4
+
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+from .client import get_db
+
+"""
+Declared indexes, per collection. Names are explicit where the generated one would be unclear, they are what
+verify compares against the server
+"""
+
+# compound index backing the feed sort and keyset paging in get_pins
+PIN_FEED_INDEX = [("created_at", DESCENDING), ("pin_id", DESCENDING)]
+# filtered feeds, equality field first then the feed sort
+PIN_CATEGORY_FEED_INDEX = [("category", ASCENDING)] + PIN_FEED_INDEX
+PIN_POSTED_BY_FEED_INDEX = [("posted_by", ASCENDING)] + PIN_FEED_INDEX
+# comments of a pin, newest first, keyset paged on (created_at, comment_id)
+COMMENT_FEED_INDEX = [("pin_id", ASCENDING), ("created_at", DESCENDING), ("comment_id", DESCENDING)]
+
+INDEXES = {
+    "pins": [
+        IndexModel([("pin_id", ASCENDING)], unique=True),
+        IndexModel(PIN_FEED_INDEX, name="created_at_-1_pin_id_-1"),
+        IndexModel(PIN_CATEGORY_FEED_INDEX, name="category_1_created_at_-1_pin_id_-1"),
+        IndexModel(PIN_POSTED_BY_FEED_INDEX, name="posted_by_1_created_at_-1_pin_id_-1"),
+        IndexModel([("title", TEXT), ("about", TEXT), ("category", TEXT)], name="pins_text",
+                   weights={"title": 3, "category": 2, "about": 1}),
+    ],
+    # materialised pin count per category, read by get_popular_pin_categories
+    "category_counts": [
+        IndexModel([("totalPins", DESCENDING)]),
+    ],
+    "comments": [
+        IndexModel([("comment_id", ASCENDING)], unique=True),
+        # $lookup from get_pin_by_id and get_comments_by_pin, comments of a pin newest first
+        IndexModel(COMMENT_FEED_INDEX, name="pin_id_1_created_at_-1_comment_id_-1"),
+    ],
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "sessions": [
+        IndexModel([("jti", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)], name="sessions_user_id"),
+        # a session is removed once its access token has expired
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "saves": [
+        IndexModel([("save_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "images": [
+        IndexModel([("sha256", ASCENDING)], unique=True),
+        IndexModel([("phash", ASCENDING)]),
+    ],
+}
+
+# indexes that are no longer declared and get in the way of the declared ones, dropped by ensure
+OBSOLETE_INDEXES = {
+    # one session per user, replaced by one session per access token
+    "sessions": ["user_id_1", "updated_at_ttl"],
+}
+
+# documents of an older schema the declared indexes can't cover, deleted by ensure before the indexes are built
+LEGACY_DOCUMENTS = {
+    # one session per user without jti or expires_at: they would be duplicate nulls under the unique jti index and
+    # never expire once updated_at_ttl is dropped. Their tokens carry no jti, so they are refused anyway
+    "sessions": {"jti": {"$exists": False}},
+}
+
+# unique indexes the db modules rely on instead of checking before a write, the app doesn't start without them
+REQUIRED_INDEXES = {
+    # create_user has no find before its insert, duplicate usernames and emails are only refused by these
+    "users": ["user_id_1", "username_1", "email_1"],
+}
+
+
+class MissingRequiredIndexes(RuntimeError):
+    """
+    Raised when an index of REQUIRED_INDEXES is not on the server
+    """
+
+
+def explain_queries():
+    """
+    The lookups the db modules run, as (name, collection, find command) for explain. Values are placeholders, only
+    the shape of the query matters to the planner
+    :return:
+    """
+    some_id = uuid4()
+    return [
+        ("feed", "pins", {"filter": {}, "sort": dict(PIN_FEED_INDEX)}),
+        ("feed by category", "pins", {"filter": {"category": {"$in": ["art"]}}, "sort": dict(PIN_FEED_INDEX)}),
+        ("feed by posted_by", "pins", {"filter": {"posted_by": {"$in": ["user"]}}, "sort": dict(PIN_FEED_INDEX)}),
+        ("pin search", "pins", {"filter": {"$text": {"$search": "art"}}}),
+        ("pin by id", "pins", {"filter": {"pin_id": some_id}}),
+        ("popular categories", "category_counts", {"filter": {"totalPins": {"$gt": 0}}, "sort": {"totalPins": -1},
+                                                   "limit": 8}),
+        ("comments of a pin", "comments", {"filter": {"pin_id": some_id},
+                                           "sort": {"created_at": -1, "comment_id": -1}}),
+        ("comment by id", "comments", {"filter": {"comment_id": some_id}}),
+        ("user by username", "users", {"filter": {"username": "user"}}),
+        ("user by email", "users", {"filter": {"email": "user@example.com"}}),
+        ("user by id", "users", {"filter": {"user_id": some_id}}),
+        ("session by jti", "sessions", {"filter": {"jti": some_id.hex}}),
+        ("sessions of a user", "sessions", {"filter": {"user_id": some_id}}),
+        ("save by id", "saves", {"filter": {"save_id": some_id}}),
+        ("image by hash", "images", {"filter": {"sha256": "0" * 64}}),
+        ("image by phash", "images", {"filter": {"phash": "0" * 16}}),
+    ]
+
+
+def missing_indexes(collection, index_information):
+    """
+    Declared indexes of a collection that are not on the server
+    :param collection:
+    :param index_information: what Collection.index_information() returned
+    :return: names of the missing indexes
+    """
+    return [index.document["name"] for index in INDEXES[collection]
+            if index.document["name"] not in index_information]
+
+
+def plan_stages(plan):
+    """
+    Every stage name in an explain plan tree
+    :param plan: queryPlanner.winningPlan of an explain result
+    :return:
+    """
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        stages += plan_stages(child)
+    return stages
+
+
+def is_collscan(explain):
+    """
+    :param explain: result of the explain command
+    :return: whether the winning plan reads the whole collection
+    """
+    return "COLLSCAN" in plan_stages(explain["queryPlanner"]["winningPlan"])
+
+
+def require_indexes(missing):
+    """
+    :param missing: what verify_indexes returned
+    :raises MissingRequiredIndexes: when one of REQUIRED_INDEXES is missing
+    """
+    required = {collection: sorted(set(names) & set(missing.get(collection, [])))
+                for collection, names in REQUIRED_INDEXES.items()}
+    required = {collection: names for collection, names in required.items() if names}
+    if required:
+        raise MissingRequiredIndexes(f"required indexes are missing: {required}")
+
+
+def ensure_indexes(db=None):
+    """
+    Delete legacy documents, drop the obsolete indexes and create every declared index. Creating an index that
+    already exists is a no-op, one that can't be built (e.g. duplicates under a unique index) is logged and the
+    others are still created
+    :param db:
+    :return: {collection: [names of the indexes that failed]}
+    """
+    db = db if db is not None else get_db()
+    for collection, query in LEGACY_DOCUMENTS.items():
+        db[collection].delete_many(query)
+    for collection, names in OBSOLETE_INDEXES.items():
+        for name in set(names) & set(db[collection].index_information()):
+            db[collection].drop_index(name)
+    failed = {}
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                db[collection].create_indexes([index])
+            except OperationFailure as e:
+                logging.error(f"could not create index {collection}.{index.document['name']}: {e}")
+                failed.setdefault(collection, []).append(index.document["name"])
+    return failed
+
+
+def verify_indexes(db=None):
+    """
+    :param db:
+    :return: {collection: [names of the declared indexes missing on the server]}
+    """
+    db = db if db is not None else get_db()
+    missing = {}
+    for collection in INDEXES:
+        names = missing_indexes(collection, db[collection].index_information())
+        if names:
+            missing[collection] = names
+    return missing
+
+
+def find_collscans(db=None):
+    """
+    Explain every query from explain_queries
+    :param db:
+    :return: names of the queries the planner answers with a COLLSCAN
+    """
+    db = db if db is not None else get_db()
+    return [name for name, collection, query in explain_queries()
+            if is_collscan(db.command("explain", {"find": collection, **query}, verbosity="queryPlanner"))]
+
+
+def main(argv=None):
+    """
+    python -m pintrigue_backend.database.mongodb.indexes ensure|verify|explain
+    Exits with 1 when an index could not be created, is missing, or a query is a COLLSCAN
+    """
+    parser = argparse.ArgumentParser(description="Manage the pintrigue MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "verify", "explain"])
+    command = parser.parse_args(argv).command
+
+    if command == "ensure":
+        problems = ensure_indexes()
+    elif command == "verify":
+        problems = verify_indexes()
+    else:
+        problems = find_collscans()
+
+    for problem in problems:
+        print(f"{command}: {problem} {problems[problem] if isinstance(problems, dict) else 'COLLSCAN'}")
+    if not problems:
+        print(f"{command}: ok")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
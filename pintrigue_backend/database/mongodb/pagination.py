@@ -0,0 +1,102 @@
+# keyset (cursor-based) pagination helpers
+
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+
+def encode_cursor(created_at, item_id, score=None):
+    """
+    Build an opaque continuation token from the sort keys of the last document on a page
+    :param created_at:
+    :param item_id:
+    :param score: text score, for pages ranked by relevance first
+    :return:
+    """
+    keys = {"c": created_at.isoformat(), "i": str(item_id)}
+    if score is not None:
+        keys["s"] = score
+    payload = json.dumps(keys, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Turn a continuation token back into its (created_at, id) sort keys.
+    Raises ValueError if the token was not produced by encode_cursor
+    :param cursor:
+    :return:
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["c"]), UUID(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def decode_score_cursor(cursor):
+    """
+    Turn a continuation token of a relevance ranked page back into its (score, created_at, id) sort keys.
+    Raises ValueError if the token was not produced by encode_cursor with a score
+    :param cursor:
+    :return:
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(payload["s"]), datetime.fromisoformat(payload["c"]), UUID(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_filter(cursor, id_field):
+    """
+    Query matching every document that sorts after the cursor on (created_at DESC, id_field DESC)
+    :param cursor:
+    :param id_field:
+    :return:
+    """
+    created_at, item_id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, id_field: {"$lt": item_id}}
+        ]
+    }
+
+
+def score_keyset_filter(cursor, id_field, score_field="score"):
+    """
+    Query matching every document that sorts after the cursor on (score DESC, created_at DESC, id_field DESC)
+    :param cursor:
+    :param id_field:
+    :param score_field:
+    :return:
+    """
+    score, created_at, item_id = decode_score_cursor(cursor)
+    return {
+        "$or": [
+            {score_field: {"$lt": score}},
+            {score_field: score, "created_at": {"$lt": created_at}},
+            {score_field: score, "created_at": created_at, id_field: {"$lt": item_id}}
+        ]
+    }
+
+
+def next_page(documents, limit, id_field, score_field=None):
+    """
+    Split the limit + 1 documents fetched for a page into the page itself and the cursor for the next one
+    :param documents:
+    :param limit:
+    :param id_field:
+    :param score_field: set when the page is ranked by this field first
+    :return:
+    """
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    last = documents[-1]
+    return documents, encode_cursor(last["created_at"], last[id_field],
+                                    score=last[score_field] if score_field else None)
@@ -0,0 +1,47 @@
+# shared motor (async mongodb) client
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from pintrigue_backend.database.mongodb.client import PINTRIGUE_DB_URI, PINTRIGUE_DB_NAME, client_options
+
+"""
+Async Mongodb connection set up, one client (and connection pool) per process shared by every db_* module
+"""
+
+_client = None
+
+
+def get_client():
+    """
+    Return the process wide async client, building it on first use
+    :return:
+    """
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(PINTRIGUE_DB_URI, **client_options())
+    return _client
+
+
+def get_db():
+    """
+    Return the pintrigue database on the shared async client
+    :return:
+    """
+    return get_client()[PINTRIGUE_DB_NAME]
+
+
+async def open_client():
+    """
+    Build the client and check the server is reachable, called on app start up
+    """
+    await get_client().admin.command("ping")
+
+
+def close_client():
+    """
+    Close the shared async client and its pool, called on app shut down
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,124 @@
+# async mongodb comment database functions, mirrors database/mongodb/db_comment.py
+
+from datetime import datetime
+from uuid import uuid4, UUID
+
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+
+from pintrigue_backend.database.cache import pin_cache, pin_cache_key
+from pintrigue_backend.database.mongodb.bulk import bulk_write_concern, prepare_documents, insert_report
+from pintrigue_backend.database.mongodb.db_comment import comment_document
+from pintrigue_backend.database.mongodb.indexes import COMMENT_FEED_INDEX
+from pintrigue_backend.database.mongodb.pagination import keyset_filter, next_page
+from .client import get_db
+
+"""
+Comment collection
+"""
+
+
+async def create_comment(pin_id, posted_by, comment):
+    """
+    With the given parameters, enter a comment doc into the 'comments' collection
+    :param pin_id:
+    :param posted_by:
+    :param comment:
+    """
+
+    uuid_object = uuid4()
+
+    try:
+        await get_db().comments.with_options(write_concern=WriteConcern(w="majority")).insert_one(  # durable writes
+            {
+                "comment_id": uuid_object,
+                "pin_id": UUID(pin_id),
+                "posted_by": posted_by,
+                "comment": comment,
+                "created_at": datetime.utcnow()
+            }
+        )
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def create_comments(comments):
+    """
+    Insert a batch of comments with one unordered insert_many, see database/mongodb/db_comment.py create_comments
+    :param comments: list of {"pin_id", "posted_by", "comment"}
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    documents, positions, errors = prepare_documents(comments, comment_document)
+    if not documents:
+        return insert_report(documents, positions, errors)
+
+    try:
+        await get_db().comments.with_options(write_concern=bulk_write_concern()).insert_many(documents,
+                                                                                            ordered=False)
+        report = insert_report(documents, positions, errors)
+    except BulkWriteError as e:
+        report = insert_report(documents, positions, errors, e)
+    except Exception as e:
+        return {"error": e}
+
+    for pin_id in {document["pin_id"] for document in documents}:
+        await pin_cache().adelete(pin_cache_key(pin_id))
+    return report
+
+
+async def update_comment(comment_id, comment):
+    """
+    With the given information, update a comment on a pin
+    :param comment_id:
+    :param comment:
+    """
+    try:
+        updated = await get_db().comments.find_one_and_update(
+            {
+                "comment_id": UUID(comment_id)
+            },
+            {"$set": {"comment": comment, "date": datetime.utcnow()}},
+            projection={"_id": 0, "pin_id": 1}
+        )
+        if updated:
+            await pin_cache().adelete(pin_cache_key(updated["pin_id"]))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def delete_comment(comment_id):
+    """
+    verify the comment_id and the user's email to delete a comment
+    :param comment_id:
+    """
+    try:
+        deleted = await get_db().comments.find_one_and_delete(
+            {
+                "comment_id": UUID(comment_id)
+            },
+            projection={"_id": 0, "pin_id": 1}
+        )
+        if deleted:
+            await pin_cache().adelete(pin_cache_key(deleted["pin_id"]))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def get_comments_by_pin(pin_id, comments_per_page, cursor=None):
+    """
+    Page through the comments of a pin newest first, see database/mongodb/db_comment.py get_comments_by_pin
+    :param pin_id:
+    :param comments_per_page:
+    :param cursor:
+    :return: (comments, next_cursor)
+    """
+    query = {"pin_id": UUID(pin_id)}
+    if cursor is not None:
+        query.update(keyset_filter(cursor, "comment_id"))
+    comments = get_db().comments.find(query, {"_id": 0}, hint=COMMENT_FEED_INDEX) \
+        .sort(COMMENT_FEED_INDEX[1:]).limit(comments_per_page + 1)
+    return next_page(await comments.to_list(None), comments_per_page, "comment_id")
@@ -0,0 +1,307 @@
+# async mongodb pin database functions, mirrors database/mongodb/db_pin.py
+
+import asyncio
+from datetime import datetime
+from uuid import uuid4, UUID
+
+from pymongo import WriteConcern
+
+from pintrigue_backend.database.mongodb.db_pin import query_sort_project, text_search_pipeline, pin_projection, \
+    CATEGORY_PIN_PROJECTION, pin_with_comments_pipeline, with_comments_cursor, category_counts_pipeline, \
+    popular_categories_query
+from pintrigue_backend.database.mongodb.pagination import keyset_filter, next_page
+from pintrigue_backend.database.cache import pin_cache, pin_cache_key, pin_count_cache, pin_count_key
+from pintrigue_backend.database.typeahead import pin_typeahead
+from .client import get_db
+
+"""
+Pin collection
+"""
+
+
+# create a pin
+async def create_pin(title, about, category, image_id, posted_by, image_variants=None):
+    """
+    With the given params, create a pin
+    :param title:
+    :param about:
+    :param category:
+    :param image_id:
+    :param posted_by:
+    :param image_variants: responsive sizes/formats of the image, [{"url", "width", "height", "format"}]
+    """
+
+    uuid_object = uuid4()
+
+    try:
+        await get_db().pins.with_options(write_concern=WriteConcern(w="majority")).insert_one(
+            {
+                "pin_id": uuid_object,
+                "created_at": datetime.utcnow(),
+                "title": title,
+                "about": about,
+                "category": category,
+                "image_id": image_id,
+                "image_variants": image_variants or [],
+                "posted_by": posted_by,
+                "comments": []
+            }
+        )
+        await increment_category_count(category, 1)
+        await adjust_pin_counts(1, category=category, posted_by=posted_by)
+        pin_typeahead.add(uuid_object, title, category)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def count_pins(query, hint_option):
+    """
+    Total for a pin listing, see database/mongodb/db_pin.py count_pins
+    :param query:
+    :param hint_option:
+    :return:
+    """
+    if not query:
+        return await get_db().pins.estimated_document_count()
+
+    cache = pin_count_cache()
+    key = pin_count_key(query)
+    total = await cache.aget(key)
+    if total is None:
+        total = await get_db().pins.count_documents(query, **hint_option)
+        await cache.aset(key, total)
+    return total
+
+
+async def adjust_pin_counts(amount, category=None, posted_by=None):
+    """
+    Keep the cached totals of the single category and posted_by listings right after a pin write
+    :param amount:
+    :param category:
+    :param posted_by:
+    """
+    for field, value in (("category", category), ("posted_by", posted_by)):
+        if value is not None:
+            await pin_count_cache().aincr(pin_count_key(query_sort_project({field: value})[0]), amount)
+
+
+# function to enable paging for pins
+async def get_pins(filters, page, pins_per_page, cursor=None, projection=None):
+    """
+    Page through pins newest first, see database/mongodb/db_pin.py get_pins
+    :param filters:
+    :param page:
+    :param pins_per_page:
+    :param cursor:
+    :param projection:
+    :return: (pins, total_num_pins, next_cursor)
+    """
+    query, sort, hint = query_sort_project(filters)
+    projection = projection or {"_id": 0}
+    hint_option = {"hint": hint} if hint else {}
+
+    total_num_pins = 0
+    if page == 0 and cursor is None:
+        total_num_pins = await count_pins(query, hint_option)
+
+    if cursor is not None:
+        keyset = keyset_filter(cursor, "pin_id")
+        query = {"$and": [query, keyset]} if query else keyset
+        fetched_pins = get_db().pins.find(query, projection, **hint_option).sort(sort).limit(pins_per_page + 1)
+    else:
+        fetched_pins = get_db().pins.find(query, projection, **hint_option).sort(sort) \
+            .skip(int(page * pins_per_page)).limit(pins_per_page + 1)
+
+    fetched_pins, next_cursor = next_page(await fetched_pins.to_list(None), pins_per_page, "pin_id")
+    return fetched_pins, total_num_pins, next_cursor
+
+
+async def search_pins(text, filters, pins_per_page, cursor=None, projection=None):
+    """
+    Full text search ranked by relevance, see database/mongodb/db_pin.py search_pins
+    :param text:
+    :param filters: optional category and posted_by
+    :param pins_per_page:
+    :param cursor:
+    :param projection:
+    :return: (pins, next_cursor), each pin with its relevance score
+    """
+    pipeline = text_search_pipeline(text, filters, pins_per_page, cursor, projection)
+    pins = await get_db().pins.aggregate(pipeline).to_list(None)
+    return next_page(pins, pins_per_page, "pin_id", score_field="score")
+
+
+# search function primarily used for the auto-complete search feature, superseded by the typeahead index
+async def get_all_pins():
+    return await get_db().pins.find({}, {"_id": 0, "comments": 0, "image_id": 0}).to_list(None)
+
+
+async def rebuild_typeahead():
+    """
+    Rebuild this worker's typeahead index from the titles and categories of every pin, the sort runs off the event
+    loop
+    """
+    pins = await get_db().pins.find({}, {"_id": 0, "pin_id": 1, "title": 1, "category": 1}).to_list(None)
+    await asyncio.get_running_loop().run_in_executor(None, pin_typeahead.rebuild, pins)
+
+
+async def get_pins_by_category(categories, projection=None):
+    try:
+        return await get_db().pins.find({"category": {"$in": [categories]}},
+                                        projection or CATEGORY_PIN_PROJECTION).to_list(None)
+    except Exception as e:
+        return {"Error": e}
+
+
+async def get_pin(title, posted_by):
+    return await get_db().pins.find_one(
+        {"posted_by": posted_by, "title": title},
+        {"_id": 0}
+    )
+
+
+async def get_pin_by_id(pin_id):
+    """
+    Using a pipeline, join two collections to get a pin with its newest comments and comment count.
+    Read through the pin cache, pin and comment writes invalidate the entry.
+    Returns None when there is no pin with the given pin_id
+    :param pin_id:
+    """
+
+    cache = pin_cache()
+    key = pin_cache_key(pin_id)
+    pin = await cache.aget(key)
+    if pin is None:
+        pins = await get_db().pins.aggregate(pin_with_comments_pipeline(pin_id)).to_list(1)
+        if not pins:
+            return None
+        pin = with_comments_cursor(pins[0])
+        await cache.aset(key, pin)
+    return pin
+
+
+async def get_popular_pin_categories(limit):
+    """
+    This function returns the top 8 most created pin categories, read from the counts maintained on every pin write
+    :return:
+    """
+    query, sort, limit = popular_categories_query(limit)
+    return await get_db().category_counts.find(query).sort(sort).limit(limit).to_list(None)
+
+
+async def increment_category_count(category, amount):
+    """
+    Adjust the number of pins in a category, called after a pin is created, deleted or moved between categories
+    :param category:
+    :param amount:
+    """
+    await get_db().category_counts.update_one({"_id": category}, {"$inc": {"totalPins": amount}}, upsert=True)
+
+
+async def reconcile_category_counts():
+    """
+    Recount every category from the pins collection, repairing drift from failed or racing increments
+    """
+    await get_db().pins.aggregate(category_counts_pipeline()).to_list(None)
+
+
+async def update_pin_title(pin_id, title):
+    """
+    Update the title of a pin
+    :param pin_id:
+    :param title:
+    """
+    try:
+        await get_db().pins.update_one(
+            {
+                "pin_id": UUID(pin_id)
+            },
+            {"$set": {"title": title}}
+        )
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        pin_typeahead.update(pin_id, title=title)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def update_pin_about(pin_id, about):
+    """
+    Update the about section of a pin
+    :param pin_id:
+    :param about:
+    """
+    try:
+        await get_db().pins.update_one(
+            {
+                "pin_id": UUID(pin_id)
+            },
+            {"$set": {"about": about}}
+        )
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def update_pin_category(pin_id, category):
+    """
+    Update a category of a pin
+    :param pin_id:
+    :param category:
+    """
+    try:
+        previous = await get_db().pins.find_one_and_update(
+            {
+                "pin_id": UUID(pin_id)
+            },
+            {"$set": {"category": category}},
+            projection={"_id": 0, "category": 1}
+        )
+        if previous and previous.get("category") != category:
+            await increment_category_count(previous.get("category"), -1)
+            await increment_category_count(category, 1)
+            await adjust_pin_counts(-1, category=previous.get("category"))
+            await adjust_pin_counts(1, category=category)
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        pin_typeahead.update(pin_id, category=category)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def update_pin_image(pin_id, image_id, image_variants=None):
+    """
+    Update a image of a pin
+    :param pin_id:
+    :param image_id:
+    :param image_variants:
+    """
+    try:
+        await get_db().pins.update_one(
+            {
+                "pin_id": UUID(pin_id)
+            },
+            {"$set": {"image_id": image_id, "image_variants": image_variants or []}}
+        )
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def delete_pin(pin_id):
+    try:
+        deleted = await get_db().pins.find_one_and_delete(
+            {"pin_id": UUID(pin_id)},
+            projection={"_id": 0, "category": 1, "posted_by": 1}
+        )
+        if deleted:
+            await increment_category_count(deleted.get("category"), -1)
+            await adjust_pin_counts(-1, category=deleted.get("category"), posted_by=deleted.get("posted_by"))
+        await pin_cache().adelete(pin_cache_key(pin_id))
+        pin_typeahead.remove(pin_id)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
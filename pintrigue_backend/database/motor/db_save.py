@@ -0,0 +1,70 @@
+# async mongodb save database functions, mirrors database/mongodb/db_save.py
+
+from uuid import uuid4, UUID
+
+from pymongo.errors import BulkWriteError
+
+from pintrigue_backend.database.mongodb.bulk import bulk_write_concern, prepare_documents, insert_report
+from pintrigue_backend.database.mongodb.db_save import save_document
+from .client import get_db
+
+"""
+Save collection
+"""
+
+
+async def add_save(posted_by, user_id):
+    """
+    When someone saves a pin, insert into 'saves' collection
+    posted_by is the maker of the post
+    user_id is the current user making the save
+    :param posted_by:
+    :param user_id:
+    """
+
+    uuid_object = uuid4()
+
+    try:
+        await get_db().saves.insert_one(
+            {
+                "save_id": uuid_object,
+                "posted_by": posted_by,
+                "user_id": user_id
+            }
+        )
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def add_saves(saves):
+    """
+    Insert a batch of saves with one unordered insert_many, see database/mongodb/db_save.py add_saves
+    :param saves: list of {"posted_by", "user_id"}
+    :return: {"success": True, "inserted": count, "errors": [{"index", "error"}]}
+    """
+    documents, positions, errors = prepare_documents(saves, save_document)
+    if not documents:
+        return insert_report(documents, positions, errors)
+
+    try:
+        await get_db().saves.with_options(write_concern=bulk_write_concern()).insert_many(documents, ordered=False)
+        return insert_report(documents, positions, errors)
+    except BulkWriteError as e:
+        return insert_report(documents, positions, errors, e)
+    except Exception as e:
+        return {"error": e}
+
+
+async def remove_save(save_id):
+    """
+    Remove a save from collection
+    :param save_id:
+    """
+
+    response = await get_db().saves.delete_one(
+        {
+            "save_id": UUID(save_id),
+        }
+    )
+    return response
@@ -0,0 +1,248 @@
+# async mongodb user database functions, mirrors database/mongodb/db_user.py
+
+from datetime import datetime
+from uuid import UUID
+
+from pymongo import WriteConcern
+from pymongo.errors import DuplicateKeyError
+
+from pintrigue_backend.database.cache import user_cache, session_cache, user_cache_key
+from pintrigue_backend.database.mongodb.db_user import duplicate_key_field, user_document
+from .client import get_db
+
+"""
+User collection
+"""
+
+
+async def login(user_id, jti, expires_at):
+    """
+    Creates an entry in the sessions collection on sign in, one per access token, and drops the cached user.
+    The TTL index on expires_at removes it once the token has expired
+    :param user_id:
+    :param jti: id of the access token
+    :param expires_at: expiry of the access token
+    :return:
+    """
+    try:
+        await get_db().sessions.insert_one(
+            {
+                "jti": jti,
+                "user_id": UUID(str(user_id)),
+                "created_at": datetime.utcnow(),
+                "expires_at": expires_at
+            }
+        )
+        # a fresh sign in reads the user from the db again, it won't be served a copy cached before it
+        await user_cache().adelete(user_cache_key(user_id))
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def verify_active_session(jti):
+    """
+    Whether the access token with this id was issued by login and has not been revoked or expired.
+    Cached for SESSION_CACHE_TTL seconds, so a session revoked through another worker is refused within that time
+    :param jti:
+    :return:
+    """
+    cache = session_cache()
+    active = await cache.aget(jti)
+    if active is None:
+        session = await get_db().sessions.find_one({"jti": jti}, {"_id": 0, "expires_at": 1})
+        active = session is not None and session["expires_at"] > datetime.utcnow()
+        await cache.aset(jti, active)
+    return active
+
+
+async def revoke_session(jti):
+    """
+    Log an access token out
+    :param jti:
+    :return:
+    """
+    try:
+        await get_db().sessions.delete_one({"jti": jti})
+        await session_cache().adelete(jti)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+async def revoke_user_sessions(user_id):
+    """
+    Log every access token of a user out
+    :param user_id:
+    :return:
+    """
+    try:
+        jtis = await get_db().sessions.distinct("jti", {"user_id": UUID(str(user_id))})
+        await get_db().sessions.delete_many({"user_id": UUID(str(user_id))})
+        for jti in jtis:
+            await session_cache().adelete(jti)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+# look up a single user
+async def get_user(username):
+    """
+    Query users collection with username.
+    No _id in response
+    :param username:
+    :return:
+    """
+    return await get_db().users.find_one({'username': username}, {"_id": 0})
+
+
+# look up a user by email
+async def get_user_by_email(email):
+    """
+    Query users collection with email
+    :param email:
+    :return:
+    """
+    return await get_db().users.find_one({'email': email}, {"_id": 0})
+
+
+# look up a user by user_id
+async def get_user_by_id(user_id):
+    return await get_db().users.find_one({'user_id': UUID(user_id)}, {"_id": 0})
+
+
+# look for all users in db
+async def get_all_users():
+    """
+    Using a cursor, query db for all users.
+    No _id in response
+    :return:
+    """
+    return await get_db().users.find({}, {"_id": 0}).to_list(None)
+
+
+# get a user's user_id
+async def get_user_id(username):
+    """
+    Query for a user_id using a username
+    :param username:
+    :return:
+    """
+    user = await get_db().users.find_one({'username': username}, {'_id': 0, "user_id": 1})
+    return user["user_id"] if user else None
+
+
+# create a user
+async def create_user(name, username, email, hashedpw, image_id):
+    """
+    Take the following params and insert doc into the 'users' collection to create a user.
+    The unique indexes on username and email reject duplicates, so this is the only round trip sign up makes
+    :param image_id:
+    :param email:
+    :param name:
+    :param username:
+    :param hashedpw:
+    :return: {"success": True, "user": the inserted user without _id and password}, {"error", "field"} for a taken
+    username or email, or {"error"} when the insert failed otherwise
+    """
+    document = user_document(name=name, username=username, email=email, hashedpw=hashedpw, image_id=image_id)
+
+    try:
+        # durable writes with majority WriteConcern
+        await get_db().users.with_options(write_concern=WriteConcern(w='majority')).insert_one(document)
+    except DuplicateKeyError as e:
+        field = duplicate_key_field(e)
+        return {"error": f"A user with the given {field or 'details'} already exists.", "field": field}
+    except Exception as e:
+        return {"error": e}
+    return {"success": True, "user": {key: value for key, value in document.items() if key not in ("_id", "password")}}
+
+
+# update username
+async def update_username(user_id, current_username, new_username):
+    """
+    User the user_id and current_username to query the correct user document then, update the username
+    :param user_id:
+    :param current_username:
+    :param new_username:
+    :return: {"success": True}, or {"error", "field"} when new_username is taken
+    """
+    try:
+        await get_db().users.update_one(
+            {"user_id": UUID(user_id), "username": current_username},
+            {"$set": {"username": new_username}}
+        )
+        await user_cache().adelete(user_cache_key(user_id))
+        return {"success": True}
+    except DuplicateKeyError as e:
+        # the unique username index refuses a name another user has
+        field = duplicate_key_field(e)
+        return {"error": f"A user with the given {field or 'details'} already exists.", "field": field}
+    except Exception as e:
+        return {"error": e}
+
+
+# update password
+async def update_password(user_id, new_password):
+    """
+    Match customer by user_id.Use the newly entered password to update in db
+    :param new_password:
+    :param user_id:
+    :return:
+    """
+    try:
+        await get_db().users.update_one(
+            {"user_id": UUID(user_id)},
+            {"$set": {"password": new_password}}
+        )
+        await user_cache().adelete(user_cache_key(user_id))
+        await revoke_user_sessions(user_id)
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+# upgrade the hash of a password on login
+async def rehash_password(user_id, old_password, new_password):
+    """
+    Replace a deprecated password hash with one of the same password, e.g. made with more bcrypt rounds.
+    Unlike update_password the sessions of the user stay valid, and a password changed since old_password was read
+    is left alone
+    :param user_id:
+    :param old_password: the hash the password was verified against
+    :param new_password: the new hash
+    :return:
+    """
+    try:
+        await get_db().users.update_one(
+            {"user_id": UUID(str(user_id)), "password": old_password},
+            {"$set": {"password": new_password}}
+        )
+        return {"success": True}
+    except Exception as e:
+        return {"error": e}
+
+
+# delete a user
+async def delete_user(user_id, email):
+    """
+    - Take the given email and delete a user from the 'users' collection
+    - Verify the user is deleted by using the get_user function
+    :param user_id:
+    :param email:
+    :return:
+    """
+
+    try:
+        await get_db().users.delete_one({"user_id": UUID(user_id), "email": email})
+        await user_cache().adelete(user_cache_key(user_id))
+        await revoke_user_sessions(user_id)
+
+        # check if the user exists in 'users' collection to confirm delete was successful
+        if await get_user(email) is None:
+            return {"success": True}
+        else:
+            raise ValueError("Deletion unsuccessful")
+    except Exception as e:
+        return {"error": e}
@@ -0,0 +1,57 @@
+# async index bootstrap, mirrors database/mongodb/indexes.py and uses its declarations
+
+import logging
+
+from pymongo.errors import OperationFailure
+
+from pintrigue_backend.database.mongodb.indexes import INDEXES, OBSOLETE_INDEXES, LEGACY_DOCUMENTS, \
+    explain_queries, missing_indexes, is_collscan
+from .client import get_db
+
+
+async def ensure_indexes():
+    """
+    Delete legacy documents, drop the obsolete indexes and create every declared index, called on app start up.
+    Creating an index that already exists is a no-op, one that can't be built (e.g. duplicates under a unique index)
+    is logged and the others are still created
+    :return: {collection: [names of the indexes that failed]}
+    """
+    for collection, query in LEGACY_DOCUMENTS.items():
+        await get_db()[collection].delete_many(query)
+    for collection, names in OBSOLETE_INDEXES.items():
+        for name in set(names) & set(await get_db()[collection].index_information()):
+            await get_db()[collection].drop_index(name)
+    failed = {}
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await get_db()[collection].create_indexes([index])
+            except OperationFailure as e:
+                logging.error(f"could not create index {collection}.{index.document['name']}: {e}")
+                failed.setdefault(collection, []).append(index.document["name"])
+    return failed
+
+
+async def verify_indexes():
+    """
+    :return: {collection: [names of the declared indexes missing on the server]}
+    """
+    missing = {}
+    for collection in INDEXES:
+        names = missing_indexes(collection, await get_db()[collection].index_information())
+        if names:
+            missing[collection] = names
+    return missing
+
+
+async def find_collscans():
+    """
+    Explain every query from explain_queries
+    :return: names of the queries the planner answers with a COLLSCAN
+    """
+    collscans = []
+    for name, collection, query in explain_queries():
+        explain = await get_db().command("explain", {"find": collection, **query}, verbosity="queryPlanner")
+        if is_collscan(explain):
+            collscans.append(name)
+    return collscans
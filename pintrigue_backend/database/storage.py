@@ -0,0 +1,201 @@
+# object storage, the backend is picked with STORAGE_BACKEND and built on first use
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# env variables
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'gcs')  # gcs or local
+# batched uploads, how many blobs are sent at once and how transient failures are retried
+STORAGE_UPLOAD_CONCURRENCY = int(os.getenv('STORAGE_UPLOAD_CONCURRENCY', 8))
+STORAGE_UPLOAD_RETRIES = int(os.getenv('STORAGE_UPLOAD_RETRIES', 3))
+STORAGE_RETRY_BACKOFF = float(os.getenv('STORAGE_RETRY_BACKOFF', 0.5))  # seconds, doubled on every retry
+
+
+class StorageBackend:
+    """
+    Interface every object storage backend implements. Blob names are '/' separated paths like
+    images/<sha256>/474w.webp
+    """
+
+    # exceptions worth retrying an upload for, e.g. throttling or a dropped connection
+    transient_errors = ()
+
+    def upload(self, source_file, blob_name, content_type=None):
+        """
+        Store the contents of a file object under blob_name, replacing any existing blob
+        :param source_file:
+        :param blob_name:
+        :param content_type:
+        """
+        raise NotImplementedError
+
+    def download(self, blob_name, destination_file):
+        """
+        Write the contents of blob_name into a file object
+        :param blob_name:
+        :param destination_file:
+        """
+        raise NotImplementedError
+
+    def delete(self, blob_name):
+        """
+        Remove blob_name, does nothing if it does not exist
+        :param blob_name:
+        """
+        raise NotImplementedError
+
+    def exists(self, blob_name):
+        """
+        :param blob_name:
+        :return: whether blob_name is stored
+        """
+        raise NotImplementedError
+
+    def signed_url(self, blob_name, expiration):
+        """
+        URL a client can fetch blob_name from without credentials until it expires
+        :param blob_name:
+        :param expiration: timedelta the URL stays valid for
+        :return:
+        """
+        raise NotImplementedError
+
+
+_storage = None
+_storage_lock = threading.Lock()
+_upload_executor = None
+
+
+def get_storage():
+    """
+    Return the configured storage backend, building it on first use
+    :return:
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == 'local':
+                    from .local_storage.local_storage import LocalStorage
+                    _storage = LocalStorage()
+                elif STORAGE_BACKEND == 'gcs':
+                    from .google_cloud.google_cloud import GoogleCloudStorage
+                    _storage = GoogleCloudStorage()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND}")
+    return _storage
+
+
+# upload blob to the configured storage
+def upload_blob(source_file_name, destination_blob_name, content_type=None):
+    """
+    File object to upload
+    :param source_file_name:
+
+    ID of the object
+    destination_blob_name = the name of the object once uploaded into the bucket
+    :param destination_blob_name:
+
+    MIME type stored on the object, served as the Content-Type header
+    :param content_type:
+    """
+    return get_storage().upload(source_file_name, destination_blob_name, content_type=content_type)
+
+
+# download blob from the configured storage
+def download_blob(source_blob_name, destination_file_name):
+    """
+    ID of the object
+    source_blob_name = "storage-object-name"
+    :param source_blob_name:
+
+    File object the blob is written to
+    :param destination_file_name:
+    """
+    return get_storage().download(source_blob_name, destination_file_name)
+
+
+def upload_blob_with_retry(source_file_name, destination_blob_name, content_type=None):
+    """
+    upload_blob, retrying transient failures with exponential backoff and jitter
+    :param source_file_name:
+    :param destination_blob_name:
+    :param content_type:
+    """
+    storage = get_storage()
+    for attempt in range(STORAGE_UPLOAD_RETRIES + 1):
+        try:
+            return storage.upload(source_file_name, destination_blob_name, content_type=content_type)
+        except storage.transient_errors as e:
+            if attempt == STORAGE_UPLOAD_RETRIES:
+                raise
+            delay = STORAGE_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"upload of {destination_blob_name} failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def _get_upload_executor():
+    global _upload_executor
+    if _upload_executor is None:
+        with _storage_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(max_workers=STORAGE_UPLOAD_CONCURRENCY,
+                                                      thread_name_prefix="storage-upload")
+    return _upload_executor
+
+
+async def upload_blobs(blobs):
+    """
+    Upload many blobs concurrently, at most STORAGE_UPLOAD_CONCURRENCY at a time over the backend's shared
+    connection pool, each retried on transient failures
+    :param blobs: list of (source file object, destination blob name, content type)
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_upload_executor()
+    await asyncio.gather(*(loop.run_in_executor(executor, upload_blob_with_retry, *blob) for blob in blobs))
+
+
+def upload_blobs_sync(blobs):
+    """
+    upload_blobs for scripts and bulk imports that don't run an event loop
+    :param blobs: list of (source file object, destination blob name, content type)
+    """
+    list(_get_upload_executor().map(lambda blob: upload_blob_with_retry(*blob), blobs))
+
+
+def close_storage():
+    """
+    Stop the upload threads, called on app shut down
+    """
+    global _upload_executor
+    with _storage_lock:
+        if _upload_executor is not None:
+            _upload_executor.shutdown(wait=True)
+            _upload_executor = None
+
+
+def delete_blob(blob_name):
+    return get_storage().delete(blob_name)
+
+
+def blob_exists(blob_name):
+    return get_storage().exists(blob_name)
+
+
+def get_signed_url(blob_name, expiration):
+    return get_storage().signed_url(blob_name, expiration)
+
+
+# get the public url for an image from within the bucket
+def get_image_url(source_blob_name):
+    url = f"{source_blob_name}"
+    return url
@@ -0,0 +1,150 @@
+# in-memory prefix index over pin titles and categories, backs the typeahead endpoint
+
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# env variables
+TYPEAHEAD_REBUILD_SECONDS = int(os.getenv("TYPEAHEAD_REBUILD_SECONDS", 300))
+TYPEAHEAD_MAX_RESULTS = int(os.getenv("TYPEAHEAD_MAX_RESULTS", 50))
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    """
+    Lower case with whitespace collapsed, so keys and prefixes compare the same way
+    :param text:
+    :return:
+    """
+    return " ".join((text or "").casefold().split())
+
+
+def prefix_keys(title, category):
+    """
+    Keys a pin is found under: its title from the start of every word, so "dusk" finds "Red barn at dusk", and its
+    category
+    :param title:
+    :param category:
+    :return:
+    """
+    title = normalize(title)
+    keys = {title[match.start():] for match in WORD.finditer(title)}
+    if category:
+        keys.add(normalize(category))
+    return keys
+
+
+class PrefixIndex:
+    """
+    Sorted array of (key, pin_id). A lookup is a bisect to the first key >= prefix followed by a walk over the keys
+    that start with it, so it costs O(log n + k). Writes insert or remove single entries, rebuild swaps in a new
+    array built from the pins collection
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    def _add(self, pin_id, title, category):
+        self._pins[pin_id] = {"pin_id": pin_id, "title": title, "category": category}
+        for key in prefix_keys(title, category):
+            insort(self._entries, (key, pin_id))
+
+    def _remove(self, pin_id):
+        pin = self._pins.pop(pin_id, None)
+        if pin is None:
+            return None
+        for key in prefix_keys(pin["title"], pin["category"]):
+            i = bisect_left(self._entries, (key, pin_id))
+            if i < len(self._entries) and self._entries[i] == (key, pin_id):
+                del self._entries[i]
+        return pin
+
+    def add(self, pin_id, title, category):
+        """
+        Index a new pin, or re-index one whose title or category changed
+        :param pin_id:
+        :param title:
+        :param category:
+        """
+        pin_id = str(pin_id)
+        with self._lock:
+            self._remove(pin_id)
+            self._add(pin_id, title, category)
+
+    def update(self, pin_id, **fields):
+        """
+        Re-index a pin with some of its fields (title, category) changed. Pins this index hasn't seen are left to
+        the next rebuild
+        :param pin_id:
+        :param fields:
+        """
+        pin_id = str(pin_id)
+        with self._lock:
+            pin = self._remove(pin_id)
+            if pin is not None:
+                pin.update(fields)
+                self._add(pin_id, pin["title"], pin["category"])
+
+    def remove(self, pin_id):
+        """
+        :param pin_id:
+        """
+        with self._lock:
+            self._remove(str(pin_id))
+
+    def rebuild(self, pins):
+        """
+        Replace the whole index
+        :param pins: iterable of {"pin_id", "title", "category"}
+        """
+        entries = []
+        indexed = {}
+        for pin in pins:
+            pin_id = str(pin["pin_id"])
+            indexed[pin_id] = {"pin_id": pin_id, "title": pin.get("title"), "category": pin.get("category")}
+            entries += [(key, pin_id) for key in prefix_keys(pin.get("title"), pin.get("category"))]
+        entries.sort()
+        with self._lock:
+            self._entries, self._pins = entries, indexed
+
+    def search(self, prefix, limit):
+        """
+        Pins whose title has a word, or whose category, starting with prefix, in key order
+        :param prefix:
+        :param limit: at most TYPEAHEAD_MAX_RESULTS
+        :return: list of {"pin_id", "title", "category"}
+        """
+        prefix = normalize(prefix)
+        limit = min(limit, TYPEAHEAD_MAX_RESULTS)
+        if not prefix or limit < 1:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            for i in range(bisect_left(self._entries, (prefix,)), len(self._entries)):
+                key, pin_id = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                if pin_id not in seen:
+                    seen.add(pin_id)
+                    results.append(dict(self._pins[pin_id]))
+                    if len(results) == limit:
+                        break
+        return results
+
+    def stats(self):
+        return {"pins": len(self._pins), "keys": len(self._entries)}
+
+
+# index of this worker process, kept current by the motor db_pin writes and rebuilt every TYPEAHEAD_REBUILD_SECONDS
+# to pick up pins written through other workers
+pin_typeahead = PrefixIndex()
@@ -1,5 +1,6 @@
 from typing import List, Optional, Dict
 from datetime import datetime
+from uuid import UUID
 
 # from bson import ObjectId
 from pydantic import BaseModel, Field
@@ -42,7 +43,8 @@ class UserCreate(User):
 
 
 class UserWithID(User):
-    user_id: str = Field(...)
+    # the UUID of the users document, or its string, serialised as the string
+    user_id: UUID = Field(...)
 
 
 class UserInDB(UserCreate):
@@ -143,8 +145,31 @@ class PinCreate(Pin):
     pass
 
 
+class ImageVariant(BaseModel):
+    url: str
+    width: int
+    height: int
+    format: str
+
+
 class PinInDB(PinCreate):
     image_id: str
-    comments: List[Comment] = None
+    image_variants: List[ImageVariant] = None
+    comments: List[Comment] = None  # the newest comments, the rest are paged from /api/comments/by_pin/{pin_id}
+    comment_count: int = None
+    next_comments_cursor: str = None
     pin_id: str
     created_at: str
+
+
+class PinCard(BaseModel):
+    """
+    A pin as listed in feed grids, the default fields of feed, search and category responses
+    """
+    pin_id: str
+    created_at: datetime
+    title: str
+    category: str
+    image_id: str
+    image_variants: List[ImageVariant] = None
+    posted_by: str
@@ -0,0 +1,38 @@
+# tests for the batched insert helpers
+
+from uuid import uuid4
+
+from pymongo.errors import BulkWriteError
+
+from pintrigue_backend.database.mongodb.bulk import prepare_documents, insert_report
+from pintrigue_backend.database.mongodb.db_comment import comment_document
+
+
+class TestBulkClass:
+
+    def test_prepare_documents(self):
+        """
+        Tests that items which can't be built are reported by position and left out of the insert
+        :return:
+        """
+        comments = [
+            {"pin_id": str(uuid4()), "posted_by": "user", "comment": "First"},
+            {"pin_id": "not-a-uuid", "posted_by": "user", "comment": "Second"},
+            {"pin_id": str(uuid4()), "posted_by": "user"},
+        ]
+        documents, positions, errors = prepare_documents(comments, comment_document)
+        assert positions == [0]
+        assert [error["index"] for error in errors] == [1, 2]
+
+    def test_insert_report(self):
+        """
+        Tests that write errors are mapped back to the position of the item in the batch
+        :return:
+        """
+        documents = [{}, {}, {}]
+        bulk_error = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "E11000 duplicate key"}],
+                                     "writeConcernErrors": []})
+        report = insert_report(documents, [0, 2, 3], [{"index": 1, "error": "invalid"}], bulk_error)
+        assert report == {"success": True, "inserted": 2,
+                          "errors": [{"index": 1, "error": "invalid"}, {"index": 2, "error": "E11000 duplicate key"}]}
+        assert insert_report(documents, [0, 1, 2], []) == {"success": True, "inserted": 3, "errors": []}
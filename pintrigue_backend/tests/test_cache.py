@@ -0,0 +1,161 @@
+# tests for the in-process cache and the redis backend
+
+import asyncio
+from uuid import uuid4
+
+from pintrigue_backend.database.cache import MemoryCache, RedisCache, pin_cache_key, pin_count_key
+
+
+class FakeRedis:
+    """
+    Keys with an expiry on a clock the test moves, and the effect of the INCR_SCRIPT script: INCRBY on an existing
+    key, which keeps its expiry
+    """
+
+    def __init__(self):
+        self.now = 0
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= self.now:
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, None if ex is None else self.now + ex)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def ttl(self, key):
+        return self.data[key][1] - self.now
+
+    def register_script(self, script):
+        def incr(keys, args):
+            if self.get(keys[0]) is None:
+                return None
+            value, expires_at = self.data[keys[0]]
+            self.data[keys[0]] = (str(int(value) + int(args[0])).encode(), expires_at)
+            return int(value) + int(args[0])
+        return incr
+
+
+class FakeAsyncRedis:
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def get(self, key):
+        return self.redis.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.redis.set(key, value, ex=ex)
+
+    async def delete(self, key):
+        self.redis.delete(key)
+
+    def register_script(self, script):
+        incr = self.redis.register_script(script)
+
+        async def aincr(keys, args):
+            return incr(keys, args)
+        return aincr
+
+
+class TestMemoryCacheClass:
+
+    def test_get_set_delete(self):
+        """
+        Tests a cached value is returned until it is deleted, and that hits and misses are counted
+        :return:
+        """
+        cache = MemoryCache("test", ttl=60, max_size=10)
+        assert cache.get("pin") is None
+        cache.set("pin", {"title": "Test pin"})
+        assert cache.get("pin") == {"title": "Test pin"}
+        cache.delete("pin")
+        assert cache.get("pin") is None
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+    def test_expiry(self):
+        """
+        Tests that entries expire after the TTL
+        :return:
+        """
+        cache = MemoryCache("test", ttl=-1, max_size=10)
+        cache.set("pin", {"title": "Test pin"})
+        assert cache.get("pin") is None
+
+    def test_lru_eviction(self):
+        """
+        Tests that the least recently used entry is evicted past max_size
+        :return:
+        """
+        cache = MemoryCache("test", ttl=60, max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+    def test_pin_cache_key(self):
+        """
+        Tests that a pin_id given as UUID, lower or upper case string maps to one key
+        :return:
+        """
+        pin_id = uuid4()
+        assert pin_cache_key(pin_id) == pin_cache_key(str(pin_id)) == pin_cache_key(str(pin_id).upper())
+
+    def test_incr(self):
+        """
+        Tests that incr adjusts a cached number and leaves missing keys alone
+        :return:
+        """
+        cache = MemoryCache("test", ttl=60, max_size=10)
+        cache.set("count", 5)
+        cache.incr("count", -1)
+        cache.incr("missing", 1)
+        assert (cache.get("count"), cache.get("missing")) == (4, None)
+
+    def test_pin_count_key(self):
+        """
+        Tests that key order and $in value order don't change the count key
+        :return:
+        """
+        assert pin_count_key({"category": {"$in": ["art", "travel"]}, "posted_by": {"$in": ["user"]}}) == \
+               pin_count_key({"posted_by": {"$in": ["user"]}, "category": {"$in": ["travel", "art"]}})
+
+
+class TestRedisCacheClass:
+
+    def test_incr_keeps_expiry(self):
+        """
+        Tests that adjusting a cached count doesn't extend its expiry, so a fresh count replaces it on time, and
+        that missing keys are left alone
+        :return:
+        """
+        redis = FakeRedis()
+        cache = RedisCache("test", ttl=60, max_size=10, client=redis, async_client=FakeAsyncRedis(redis))
+        cache.set("count", 5)
+        redis.now = 30
+        cache.incr("count", -1)
+        asyncio.run(cache.aincr("count", 3))
+        cache.incr("missing", 1)
+
+        assert (cache.get("count"), cache.get("missing")) == (7, None)
+        assert redis.ttl(cache._key("count")) == 30
+        redis.now = 60
+        assert cache.get("count") is None
+
+    def test_values_round_trip(self):
+        """
+        Tests that numbers and pickled values read back the same
+        :return:
+        """
+        redis = FakeRedis()
+        cache = RedisCache("test", ttl=60, max_size=10, client=redis, async_client=FakeAsyncRedis(redis))
+        for value in (0, -3, True, {"title": "Test pin"}, [1, 2]):
+            cache.set("value", value)
+            assert cache.get("value") == value
+            assert type(cache.get("value")) is type(value)
@@ -5,8 +5,8 @@ from random import choice
 from faker import Faker
 
 from pintrigue_backend.database.mongodb.db_comment import create_comment,   get_random_comment, get_comment, \
-    update_comment, delete_comment
-from pintrigue_backend.database.mongodb.db_pin import get_random_pin
+    update_comment, delete_comment, get_comments_by_pin
+from pintrigue_backend.database.mongodb.db_pin import get_random_pin, get_pin_by_id
 from pintrigue_backend.database.mongodb.db_user import get_all_users
 
 
@@ -41,3 +41,23 @@ class TestCommentClass:
                        comment=comment)
         comment = get_comment(pin_id=str(pin['pin_id']), posted_by=get_random_user['username'], comment=comment)
         assert delete_comment(comment_id=str(comment['comment_id'])) == {"success": True}
+
+    def test_get_comments_by_pin(self, get_random_user):
+        """
+        Tests that paging through a pin's comments returns each of them once, newest first, and that the pin detail
+        counts them all
+        :param get_random_user:
+        :return:
+        """
+        pin = get_random_pin()
+        for _ in range(3):
+            create_comment(pin_id=str(pin['pin_id']), posted_by=get_random_user['username'], comment=fake.text())
+
+        comments, cursor = get_comments_by_pin(pin_id=str(pin['pin_id']), comments_per_page=2)
+        while cursor:
+            page, cursor = get_comments_by_pin(pin_id=str(pin['pin_id']), comments_per_page=2, cursor=cursor)
+            comments += page
+        assert len({comment['comment_id'] for comment in comments}) == len(comments)
+        assert [comment['created_at'] for comment in comments] == \
+               sorted((comment['created_at'] for comment in comments), reverse=True)
+        assert get_pin_by_id(pin_id=str(pin['pin_id']))['comment_count'] == len(comments)
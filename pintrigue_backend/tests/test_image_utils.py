@@ -0,0 +1,189 @@
+# tests for image conversion and the image process pool
+
+import asyncio
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from pintrigue_backend.api import image_utils
+from pintrigue_backend.api.image_utils import convert_image, default_variant, spool_upload, ImageTooLarge, \
+    UploadLimitMiddleware, IMAGE_FORMATS
+from pintrigue_backend.api.workers import BoundedProcessPool, PoolSaturated
+
+
+@pytest.fixture
+def jpeg_path(tmp_path):
+    path = tmp_path / "upload.jpg"
+    Image.new("RGB", (1200, 800), "red").save(path, format="JPEG")
+    return str(path)
+
+
+def upload(middleware, chunks, content_length=None, path="/api/pins/upload_image"):
+    """
+    Send a request body in chunks through the middleware to an app reading all of it
+    :param middleware: UploadLimitMiddleware factory taking the app
+    :param chunks:
+    :param content_length: Content-Length header, none when not given
+    :param path:
+    :return: (response status, messages the app received)
+    """
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    body = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+    received = []
+    sent = []
+
+    async def receive():
+        return body.pop(0) if body else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            received.append(message)
+            if message["type"] == "http.disconnect" or not message.get("more_body"):
+                break
+        # a cut off body is answered with an error, like FastAPI failing to parse the form
+        status = 400 if message["type"] == "http.disconnect" else 200
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    asyncio.run(middleware(app)(scope, receive, send))
+    return [message["status"] for message in sent if message["type"] == "http.response.start"], received
+
+
+class TestUploadLimitMiddlewareClass:
+
+    def test_content_length_over_limit(self):
+        """
+        Tests that a body announced over the limit gets a 413 without reaching the app
+        :return:
+        """
+        statuses, received = upload(lambda app: UploadLimitMiddleware(app, max_bytes=10), [b"x" * 20],
+                                    content_length=20)
+        assert statuses == [413]
+        assert received == []
+
+    def test_streamed_body_over_limit(self):
+        """
+        Tests that a body without a Content-Length gets a 413 once it passes the limit, the app sees a disconnect and
+        the rest of the body isn't read
+        :return:
+        """
+        statuses, received = upload(lambda app: UploadLimitMiddleware(app, max_bytes=10), [b"x" * 6] * 5)
+        assert statuses == [413]
+        assert [message["type"] for message in received] == ["http.request", "http.disconnect"]
+
+    def test_within_limit(self):
+        """
+        Tests that uploads within the limit and other routes pass through
+        :return:
+        """
+        limit = lambda app: UploadLimitMiddleware(app, max_bytes=10)
+        assert upload(limit, [b"x" * 5, b"x" * 5], content_length=10)[0] == [200]
+        assert upload(limit, [b"x" * 20], content_length=20, path="/api/users/sign-up")[0] == [200]
+
+
+class TestImageUtilsClass:
+
+    def test_convert_image(self, jpeg_path):
+        """
+        Tests that an upload is encoded at every variant width below its own, in every format
+        :param jpeg_path:
+        :return:
+        """
+        variants = convert_image(jpeg_path)["variants"]
+        assert [(variant["width"], variant["format"]) for variant in variants] == \
+               [(width, image_format) for width in (1200, 736, 474, 236) for image_format in IMAGE_FORMATS]
+        for variant in variants:
+            with Image.open(io.BytesIO(variant["data"])) as im:
+                assert im.format == variant["format"].upper()
+                assert im.size == (variant["width"], variant["height"])
+
+    def test_default_variant(self, jpeg_path):
+        """
+        Tests that the default variant is the WebP one closest to IMAGE_DEFAULT_WIDTH
+        :param jpeg_path:
+        :return:
+        """
+        variant = default_variant(convert_image(jpeg_path)["variants"])
+        assert (variant["width"], variant["format"]) == (474, "webp")
+
+    def test_perceptual_hash(self, jpeg_path):
+        """
+        Tests that re-encoding an image at another size and quality keeps its perceptual hash
+        :param jpeg_path:
+        :return:
+        """
+        im = Image.new("RGB", (1200, 800), "white")
+        im.paste(Image.new("RGB", (600, 800), "black"))
+        original, resized = io.BytesIO(), io.BytesIO()
+        im.save(original, format="PNG")
+        im.resize((600, 400)).save(resized, format="JPEG", quality=50)
+        assert convert_image(original)["phash"] == convert_image(resized)["phash"]
+        assert convert_image(original)["phash"] != convert_image(jpeg_path)["phash"]
+
+    def test_convert_invalid_image(self):
+        """
+        Tests that bytes Pillow can't read raise ValueError
+        :return:
+        """
+        with pytest.raises(ValueError):
+            convert_image(io.BytesIO(b"not an image"))
+
+    def test_convert_too_many_pixels(self, jpeg_path, monkeypatch):
+        """
+        Tests that the pixel limit is enforced
+        :param jpeg_path:
+        :param monkeypatch:
+        :return:
+        """
+        monkeypatch.setattr(image_utils, "IMAGE_MAX_PIXELS", 1200 * 800 - 1)
+        with pytest.raises(ImageTooLarge):
+            convert_image(jpeg_path)
+
+    def test_spool_upload(self, jpeg_path, monkeypatch):
+        """
+        Tests that an upload is streamed to a temporary file and that the byte limit is enforced
+        :param jpeg_path:
+        :param monkeypatch:
+        :return:
+        """
+        with open(jpeg_path, "rb") as f:
+            data = f.read()
+
+        path, sha256 = asyncio.run(spool_upload(UploadFile(filename="upload.jpg", file=io.BytesIO(data))))
+        with open(path, "rb") as f:
+            assert f.read() == data
+        os.unlink(path)
+
+        monkeypatch.setattr(image_utils, "IMAGE_MAX_UPLOAD_BYTES", len(data) - 1)
+        with pytest.raises(ImageTooLarge):
+            asyncio.run(spool_upload(UploadFile(filename="upload.jpg", file=io.BytesIO(data))))
+
+    def test_pool_convert_and_saturate(self, jpeg_path):
+        """
+        Tests converting in a worker process, that submits past max_pending are rejected and completed ones timed
+        :param jpeg_path:
+        :return:
+        """
+        pool = BoundedProcessPool("test", max_workers=1, max_pending=1)
+
+        async def submit_two():
+            return await asyncio.gather(pool.submit(convert_image, jpeg_path),
+                                        pool.submit(convert_image, jpeg_path), return_exceptions=True)
+
+        try:
+            converted, rejected = asyncio.run(submit_two())
+        finally:
+            pool.shutdown()
+        assert converted == convert_image(jpeg_path)
+        assert isinstance(rejected, PoolSaturated)
+        assert pool.stats()["rejected"] == 1
+        assert pool.stats()["completed"] == 1
+        assert pool.stats()["max_seconds"] >= pool.stats()["avg_seconds"] > 0
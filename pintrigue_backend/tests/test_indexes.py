@@ -0,0 +1,107 @@
+# tests for the index declarations and explain helpers
+
+from collections import defaultdict
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from pintrigue_backend.database.mongodb.indexes import INDEXES, MissingRequiredIndexes, missing_indexes, \
+    is_collscan, ensure_indexes, verify_indexes, require_indexes
+
+
+class FakeCollection:
+    """
+    Just enough of a collection for ensure_indexes: documents, unique indexes and $exists queries
+    """
+
+    def __init__(self, documents=(), index_names=()):
+        self.documents = list(documents)
+        self.indexes = {"_id_": {}, **{name: {} for name in index_names}}
+
+    def _matches(self, document, query):
+        return all((field in document) == condition["$exists"] for field, condition in query.items())
+
+    def delete_many(self, query):
+        self.documents = [document for document in self.documents if not self._matches(document, query)]
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def drop_index(self, name):
+        del self.indexes[name]
+
+    def create_indexes(self, indexes):
+        for index in indexes:
+            document = index.document
+            if document.get("unique"):
+                keys = [tuple(doc.get(field) for field in document["key"]) for doc in self.documents]
+                if len(keys) != len(set(keys)):
+                    raise OperationFailure(f"E11000 duplicate key error index: {document['name']}", 11000)
+            self.indexes[document["name"]] = document
+
+
+class FakeDB(defaultdict):
+    def __init__(self, **collections):
+        super().__init__(FakeCollection, collections)
+
+
+class TestIndexesClass:
+
+    def test_missing_indexes(self):
+        """
+        Tests that declared indexes are matched to the server's by name
+        :return:
+        """
+        index_information = {"_id_": {}, "sha256_1": {}}
+        assert missing_indexes("images", index_information) == ["phash_1"]
+        assert missing_indexes("images", {**index_information, "phash_1": {}}) == []
+
+    def test_index_names_unique(self):
+        """
+        Tests that no collection declares two indexes with the same name
+        :return:
+        """
+        for indexes in INDEXES.values():
+            names = [index.document["name"] for index in indexes]
+            assert len(names) == len(set(names))
+
+    def test_is_collscan(self):
+        """
+        Tests finding a COLLSCAN anywhere in a winning plan
+        :return:
+        """
+        ixscan = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+        collscan = {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+        assert not is_collscan({"queryPlanner": {"winningPlan": ixscan}})
+        assert is_collscan({"queryPlanner": {"winningPlan": collscan}})
+        assert is_collscan({"queryPlanner": {"winningPlan": {"stage": "OR", "inputStages": [ixscan, collscan]}}})
+
+    def test_ensure_upgrades_sessions(self):
+        """
+        Tests that the one-per-user sessions without a jti are deleted and their indexes dropped, so the unique jti
+        and the expires_at TTL index build and the sessions of access tokens are kept
+        :return:
+        """
+        session = {"jti": uuid4().hex, "user_id": uuid4(), "expires_at": datetime.utcnow()}
+        legacy = [{"user_id": uuid4(), "updated_at": datetime.utcnow()} for _ in range(2)]
+        db = FakeDB(sessions=FakeCollection(legacy + [session], index_names=["user_id_1", "updated_at_ttl"]))
+
+        assert ensure_indexes(db) == {}
+        assert db["sessions"].documents == [session]
+        assert missing_indexes("sessions", db["sessions"].index_information()) == []
+        assert not {"user_id_1", "updated_at_ttl"} & set(db["sessions"].index_information())
+
+    def test_required_unique_index_failure(self):
+        """
+        Tests that a unique user index that can't be built because of duplicates is reported, and that
+        require_indexes then refuses to go on while other missing indexes are tolerated
+        :return:
+        """
+        db = FakeDB(users=FakeCollection([{"user_id": uuid4(), "username": "taken", "email": f"{i}@example.com"}
+                                          for i in range(2)]))
+        assert ensure_indexes(db) == {"users": ["username_1"]}
+        with pytest.raises(MissingRequiredIndexes):
+            require_indexes(verify_indexes(db))
+        require_indexes({"images": ["phash_1"]})
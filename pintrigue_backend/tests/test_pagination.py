@@ -0,0 +1,66 @@
+# tests for the keyset pagination helpers
+
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from pintrigue_backend.database.mongodb.pagination import encode_cursor, decode_cursor, keyset_filter, next_page, \
+    decode_score_cursor, score_keyset_filter
+
+
+class TestPaginationClass:
+
+    def test_cursor_round_trip(self):
+        """
+        Tests that a cursor decodes back to the sort keys it was built from
+        :return:
+        """
+        created_at = datetime(2022, 5, 1, 12, 30, 15, 123000)
+        pin_id = uuid4()
+        assert decode_cursor(encode_cursor(created_at, pin_id)) == (created_at, pin_id)
+
+    def test_decode_invalid_cursor(self):
+        """
+        Tests that a tampered cursor raises ValueError
+        :return:
+        """
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_keyset_filter(self):
+        """
+        Tests the range query built from a cursor
+        :return:
+        """
+        created_at = datetime(2022, 5, 1)
+        pin_id = uuid4()
+        assert keyset_filter(encode_cursor(created_at, pin_id), "pin_id") == {
+            "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "pin_id": {"$lt": pin_id}}
+            ]
+        }
+
+    def test_next_page(self):
+        """
+        Tests that the extra fetched document only produces a cursor and is not returned
+        :return:
+        """
+        documents = [{"created_at": datetime(2022, 5, day), "pin_id": uuid4()} for day in range(3, 0, -1)]
+        page, cursor = next_page(documents, 2, "pin_id")
+        assert page == documents[:2]
+        assert decode_cursor(cursor) == (documents[1]["created_at"], documents[1]["pin_id"])
+        assert next_page(documents, 3, "pin_id") == (documents, None)
+
+    def test_score_cursor(self):
+        """
+        Tests the cursor of a relevance ranked page and the range query built from it
+        :return:
+        """
+        documents = [{"score": score, "created_at": datetime(2022, 5, 1), "pin_id": uuid4()} for score in (2.5, 1.25)]
+        page, cursor = next_page(documents, 1, "pin_id", score_field="score")
+        assert decode_score_cursor(cursor) == (2.5, datetime(2022, 5, 1), documents[0]["pin_id"])
+        assert score_keyset_filter(cursor, "pin_id")["$or"][0] == {"score": {"$lt": 2.5}}
+        with pytest.raises(ValueError):
+            decode_score_cursor(encode_cursor(datetime(2022, 5, 1), uuid4()))
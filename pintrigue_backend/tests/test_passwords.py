@@ -0,0 +1,94 @@
+# tests for password hashing and the rehash on login
+
+import asyncio
+from uuid import uuid4
+
+from passlib.hash import bcrypt, sha256_crypt
+
+from pintrigue_backend.api.auth import passwords
+from pintrigue_backend.api.auth.passwords import PASSWORD_HASH_ROUNDS, password_context, pwd_context, \
+    verify_and_update_password
+
+
+def login(monkeypatch, stored_hash, password):
+    """
+    Run authenticate_user against a user with stored_hash, verifying in process instead of the password pool
+    :param monkeypatch:
+    :param stored_hash:
+    :param password:
+    :return: (result of authenticate_user, the rehash_password calls)
+    """
+    # auth_utils needs TOKEN_URL at import, keep the tests of passwords alone collectable without it
+    from pintrigue_backend.api.auth import auth_utils
+
+    user = {"user_id": uuid4(), "username": "testuser", "password": stored_hash}
+    rehashes = []
+
+    async def get_user(username):
+        return user
+
+    async def check_password(plain_password, hashed_password):
+        return verify_and_update_password(plain_password, hashed_password)
+
+    async def rehash_password(**kwargs):
+        rehashes.append(kwargs)
+        return {"success": True}
+
+    monkeypatch.setattr(auth_utils, "get_user", get_user)
+    monkeypatch.setattr(auth_utils, "check_password", check_password)
+    monkeypatch.setattr(auth_utils, "rehash_password", rehash_password)
+    return asyncio.run(auth_utils.authenticate_user("testuser", password)), rehashes
+
+
+class TestPasswordsClass:
+
+    def test_current_hash_is_kept(self):
+        """
+        Tests that a hash made with PASSWORD_HASH_ROUNDS verifies without an update
+        :return:
+        """
+        assert verify_and_update_password("test123", pwd_context.hash("test123")) == (True, None)
+
+    def test_too_few_rounds_rehashed_on_login(self, monkeypatch):
+        """
+        Tests that a successful login replaces a hash made with fewer rounds, conditioned on the old hash
+        :param monkeypatch:
+        :return:
+        """
+        old_hash = bcrypt.using(rounds=4).hash("test123")
+        user, rehashes = login(monkeypatch, old_hash, "test123")
+
+        assert user["username"] == "testuser"
+        assert len(rehashes) == 1
+        assert rehashes[0]["user_id"] == user["user_id"]
+        assert rehashes[0]["old_password"] == old_hash
+        new_hash = rehashes[0]["new_password"]
+        assert bcrypt.from_string(new_hash).rounds == PASSWORD_HASH_ROUNDS
+        assert pwd_context.verify("test123", new_hash)
+        assert not pwd_context.needs_update(new_hash)
+
+    def test_deprecated_scheme_rehashed_on_login(self, monkeypatch):
+        """
+        Tests that a successful login replaces the hash of a legacy scheme with a bcrypt one
+        :param monkeypatch:
+        :return:
+        """
+        monkeypatch.setattr(passwords, "pwd_context", password_context(PASSWORD_HASH_ROUNDS, ["sha256_crypt"]))
+        old_hash = sha256_crypt.hash("test123")
+        user, rehashes = login(monkeypatch, old_hash, "test123")
+
+        assert user
+        assert len(rehashes) == 1
+        assert rehashes[0]["old_password"] == old_hash
+        assert bcrypt.identify(rehashes[0]["new_password"])
+
+    def test_failed_login_not_rehashed(self, monkeypatch):
+        """
+        Tests that a wrong password is refused and its deprecated hash left alone
+        :param monkeypatch:
+        :return:
+        """
+        assert verify_and_update_password("wrong", bcrypt.using(rounds=4).hash("test123")) == (False, None)
+        user, rehashes = login(monkeypatch, bcrypt.using(rounds=4).hash("test123"), "wrong")
+        assert user is False
+        assert rehashes == []
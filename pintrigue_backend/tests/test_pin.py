@@ -1,13 +1,16 @@
 # test functions for pins
 
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 from random import randint, choice
 import pytest
 
 from pintrigue_backend.database.mongodb.db_pin import create_pin, get_pins_by_category, get_random_pin, \
-    get_pin_by_id, delete_pin, get_pin, update_pin_title, update_pin_about, update_pin_category
+    get_pin_by_id, delete_pin, get_pin, update_pin_title, update_pin_about, update_pin_category, get_pins, \
+    search_pins, query_sort_project, pin_projection, PIN_CARD_FIELDS
 from pintrigue_backend.database.mongodb.db_user import get_all_users
+from pintrigue_backend.schemas.schemas import PinCard
 
 load_dotenv()
 
@@ -55,6 +58,53 @@ class TestPinClass:
 
         assert get_pins_by_category(categories=get_rand_category) == get_pins_by_category(categories=get_rand_category)
 
+    def test_query_sort_project(self):
+        """
+        Tests that every filter is applied together and the hint follows the most selective one
+        :return:
+        """
+        created_after = datetime(2022, 1, 1)
+        query, sort, hint = query_sort_project({"category": ["art", "travel"], "posted_by": "user",
+                                                "created_after": created_after})
+        assert query == {"category": {"$in": ["art", "travel"]}, "posted_by": {"$in": ["user"]},
+                         "created_at": {"$gte": created_after}}
+        assert hint[0] == ("posted_by", 1)
+        assert query_sort_project({"category": "art"})[2][0] == ("category", 1)
+        assert query_sort_project({"text": "art", "category": "art"})[2] is None
+        assert query_sort_project(None) == ({}, sort, sort)
+
+    def test_pin_projection(self):
+        """
+        Tests the PinCard projection and sparse fieldsets, which always keep the cursor fields
+        :return:
+        """
+        assert set(pin_projection()) - {"_id"} == set(PinCard.__fields__) == set(PIN_CARD_FIELDS)
+        assert pin_projection(["title"]) == {"_id": 0, "pin_id": 1, "created_at": 1, "title": 1}
+        with pytest.raises(ValueError):
+            pin_projection(["password"])
+
+    def test_get_pins_cursor(self):
+        """
+        Tests that following next_cursor returns the same page as skipping to it
+        :return:
+        """
+        _, _, next_cursor = get_pins(filters=None, page=0, pins_per_page=5)
+        second_page, _, _ = get_pins(filters=None, page=1, pins_per_page=5)
+        assert get_pins(filters=None, page=0, pins_per_page=5, cursor=next_cursor)[0] == second_page
+
+    def test_search_pins(self):
+        """
+        Tests that text search results are ranked by score and that next_cursor continues the ranking
+        :return:
+        """
+        pin = get_random_pin()
+        first_page, next_cursor = search_pins(text=pin['title'], filters=None, pins_per_page=2)
+        scores = [result['score'] for result in first_page]
+        assert scores == sorted(scores, reverse=True)
+        if next_cursor:
+            second_page, _ = search_pins(text=pin['title'], filters=None, pins_per_page=2, cursor=next_cursor)
+            assert second_page[0]['score'] <= scores[-1]
+
     def test_get_pin_by_id(self):
         """
         Tests the get_pin_by_id function, uses the get_random_pin function to pull a random pin from the DB
@@ -0,0 +1,137 @@
+# tests for the token bucket rate limits
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
+
+from pintrigue_backend.api import rate_limit
+from pintrigue_backend.api.rate_limit import MemoryRateLimitStore, RateLimitMiddleware, RATE_LIMIT_RULES, \
+    match_rule, limit_username
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def http_scope(path, method="POST", client="10.0.0.1"):
+    return {"type": "http", "method": method, "path": path, "headers": [], "client": (client, 50000)}
+
+
+def call(middleware, scope):
+    """
+    Run a request through the middleware
+    :param middleware:
+    :param scope:
+    :return: response status
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return messages[0]["status"]
+
+
+def login_form(username):
+    return OAuth2PasswordRequestForm(username=username, password="wrong", scope="")
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+class TestMemoryRateLimitStoreClass:
+
+    def test_burst_then_refill(self):
+        """
+        Tests that a bucket allows burst requests at once, then one more per 1 / rate seconds
+        :return:
+        """
+        clock = Clock()
+        store = MemoryRateLimitStore(clock=clock)
+        assert [store.take("ip", rate=0.5, burst=3) for _ in range(3)] == [0, 0, 0]
+        assert store.take("ip", rate=0.5, burst=3) == pytest.approx(2)
+
+        clock.now = 1
+        assert store.take("ip", rate=0.5, burst=3) == pytest.approx(1)
+        clock.now = 2
+        assert store.take("ip", rate=0.5, burst=3) == 0
+        assert store.stats() == {"allowed": 4, "limited": 2, "keys": 1}
+
+    def test_refill_is_capped_at_burst(self):
+        """
+        Tests that an idle bucket holds no more than burst tokens
+        :return:
+        """
+        clock = Clock()
+        store = MemoryRateLimitStore(clock=clock)
+        store.take("ip", rate=1, burst=2)
+        clock.now = 1000
+        assert [store.take("ip", rate=1, burst=2) for _ in range(3)][-1] > 0
+
+    def test_keys_are_independent_and_bounded(self):
+        """
+        Tests that each key has its own bucket, and that the least recently used ones are dropped past max_keys
+        :return:
+        """
+        store = MemoryRateLimitStore(max_keys=2, clock=Clock())
+        assert store.take("a", rate=1, burst=1) == 0
+        assert store.take("b", rate=1, burst=1) == 0
+        assert store.take("a", rate=1, burst=1) > 0
+        store.take("c", rate=1, burst=1)
+        assert store.stats()["keys"] == 2
+        assert store.take("b", rate=1, burst=1) == 0
+
+
+class TestRateLimitMiddlewareClass:
+
+    def test_match_rule(self):
+        """
+        Tests that auth and upload routes are limited, reads are not
+        :return:
+        """
+        assert match_rule(RATE_LIMIT_RULES, "POST", "/api/auth/login/access-token")["name"] == "auth"
+        assert match_rule(RATE_LIMIT_RULES, "PUT", "/api/users/password-change/<user_id>/")["name"] == "auth"
+        assert match_rule(RATE_LIMIT_RULES, "POST", "/api/pins/upload_image")["name"] == "upload"
+        assert match_rule(RATE_LIMIT_RULES, "GET", "/api/pins/upload_image") is None
+        assert match_rule(RATE_LIMIT_RULES, "GET", "/api/pins/") is None
+
+    def test_limits_per_ip(self):
+        """
+        Tests that requests past the burst get a 429 without reaching the app, per client address
+        :return:
+        """
+        rules = [{"name": "auth", "methods": {"POST"}, "paths": ["/api/auth/login"], "rate": 1 / 60, "burst": 2}]
+        middleware = RateLimitMiddleware(ok_app, rules=rules, store=MemoryRateLimitStore(clock=Clock()))
+
+        assert [call(middleware, http_scope("/api/auth/login/access-token")) for _ in range(3)] == [200, 200, 429]
+        assert call(middleware, http_scope("/api/auth/login/access-token", client="10.0.0.2")) == 200
+        assert call(middleware, http_scope("/api/pins/", method="GET")) == 200
+
+    def test_limit_username(self, monkeypatch):
+        """
+        Tests that sign in attempts are limited per username, whatever its case
+        :param monkeypatch:
+        :return:
+        """
+        monkeypatch.setattr(rate_limit, "_store", MemoryRateLimitStore(clock=Clock()))
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_USERNAME_BURST", 2)
+
+        for username in ("TestUser", "testuser"):
+            asyncio.run(limit_username(login_form(username)))
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(limit_username(login_form("testUSER")))
+        assert e.value.status_code == 429
+        assert int(e.value.headers["Retry-After"]) >= 1
+        asyncio.run(limit_username(login_form("otheruser")))
@@ -0,0 +1,92 @@
+# tests for the local storage backend and batched uploads
+
+import asyncio
+import io
+from datetime import timedelta
+
+import pytest
+
+from pintrigue_backend.database import storage
+from pintrigue_backend.database.local_storage.local_storage import LocalStorage
+
+
+@pytest.fixture
+def local_storage(tmp_path):
+    return LocalStorage(root=tmp_path)
+
+
+class TestLocalStorageClass:
+
+    def test_upload_download(self, local_storage):
+        """
+        Tests that an uploaded blob, including nested blob names, downloads with the same contents
+        :param local_storage:
+        :return:
+        """
+        local_storage.upload(io.BytesIO(b"image bytes"), "images/abc/236w.webp", content_type="image/webp")
+        destination = io.BytesIO()
+        local_storage.download("images/abc/236w.webp", destination)
+        assert destination.getvalue() == b"image bytes"
+        assert local_storage.signed_url("images/abc/236w.webp", timedelta(minutes=5)).startswith("file://")
+
+    def test_exists_delete(self, local_storage):
+        """
+        Tests exists before and after a delete, and that deleting a missing blob is not an error
+        :param local_storage:
+        :return:
+        """
+        local_storage.upload(io.BytesIO(b""), "empty.webp")
+        assert local_storage.exists("empty.webp")
+        local_storage.delete("empty.webp")
+        assert not local_storage.exists("empty.webp")
+        local_storage.delete("empty.webp")
+
+    def test_blob_name_outside_root(self, local_storage):
+        """
+        Tests that blob names can't escape the storage root
+        :param local_storage:
+        :return:
+        """
+        with pytest.raises(ValueError):
+            local_storage.upload(io.BytesIO(b"x"), "../escape.webp")
+
+
+class FlakyStorage(LocalStorage):
+    """
+    Local storage whose first upload of every blob fails with a transient error
+    """
+
+    transient_errors = (ConnectionError,)
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.attempts = {}
+
+    def upload(self, source_file, blob_name, content_type=None):
+        self.attempts[blob_name] = self.attempts.get(blob_name, 0) + 1
+        if self.attempts[blob_name] == 1:
+            raise ConnectionError("connection reset")
+        super().upload(source_file, blob_name, content_type=content_type)
+
+
+class TestUploadBlobsClass:
+
+    def test_upload_blobs_retries(self, tmp_path, monkeypatch):
+        """
+        Tests that a batch is uploaded in full when every blob first fails with a transient error
+        :param tmp_path:
+        :param monkeypatch:
+        :return:
+        """
+        flaky_storage = FlakyStorage(root=tmp_path)
+        monkeypatch.setattr(storage, "_storage", flaky_storage)
+        monkeypatch.setattr(storage, "STORAGE_RETRY_BACKOFF", 0)
+
+        blobs = [(io.BytesIO(f"variant {width}".encode()), f"images/abc/{width}w.webp", "image/webp")
+                 for width in (236, 474, 736)]
+        asyncio.run(storage.upload_blobs(blobs))
+        storage.close_storage()
+
+        assert flaky_storage.attempts == {blob_name: 2 for _, blob_name, _ in blobs}
+        for _, blob_name, _ in blobs:
+            assert flaky_storage.exists(blob_name)
@@ -0,0 +1,32 @@
+# tests for periodic background tasks
+
+import asyncio
+
+from pintrigue_backend.api.tasks import PeriodicTask
+
+
+class TestPeriodicTaskClass:
+
+    def test_runs_until_stopped(self):
+        """
+        Tests that the job runs every interval, failed runs are counted and don't stop the task
+        :return:
+        """
+        calls = []
+
+        async def job():
+            calls.append(len(calls))
+            if len(calls) == 2:
+                raise RuntimeError("reconcile failed")
+
+        async def run_for_a_while():
+            task = PeriodicTask("test", 0.01, job)
+            task.start()
+            await asyncio.sleep(0.1)
+            await task.stop()
+            return task
+
+        task = asyncio.run(run_for_a_while())
+        assert len(calls) >= 3
+        assert task.stats()["failures"] == 1
+        assert task.stats()["runs"] == len(calls) - 1
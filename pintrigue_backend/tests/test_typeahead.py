@@ -0,0 +1,44 @@
+# tests for the typeahead prefix index
+
+from uuid import uuid4
+
+from pintrigue_backend.database.typeahead import PrefixIndex
+
+
+def titles(results):
+    return [result["title"] for result in results]
+
+
+class TestPrefixIndexClass:
+
+    def test_search(self):
+        """
+        Tests matching any title word or the category, case insensitively and once per pin
+        :return:
+        """
+        index = PrefixIndex()
+        index.rebuild([
+            {"pin_id": uuid4(), "title": "Red barn at dusk", "category": "photography"},
+            {"pin_id": uuid4(), "title": "Barn owl", "category": "birds"},
+            {"pin_id": uuid4(), "title": "Dusty road", "category": "photography"},
+        ])
+        assert titles(index.search("BARN", 10)) == ["Red barn at dusk", "Barn owl"]
+        assert titles(index.search("dus", 10)) == ["Red barn at dusk", "Dusty road"]
+        assert sorted(titles(index.search("photo", 10))) == ["Dusty road", "Red barn at dusk"]
+        assert titles(index.search("barn", 1)) == ["Red barn at dusk"]
+        assert index.search("zebra", 10) == [] and index.search(" ", 10) == []
+
+    def test_writes(self):
+        """
+        Tests that adds, updates and removes are visible to the next search
+        :return:
+        """
+        index = PrefixIndex()
+        pin_id = uuid4()
+        index.add(pin_id, "Sunset", "travel")
+        index.update(pin_id, title="Sunrise")
+        assert titles(index.search("sun", 10)) == ["Sunrise"]
+        assert titles(index.search("trav", 10)) == ["Sunrise"]
+        index.remove(str(pin_id))
+        assert index.search("sun", 10) == []
+        assert index.stats() == {"pins": 0, "keys": 0}
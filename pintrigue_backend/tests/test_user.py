@@ -1,14 +1,18 @@
 # tests for user functions
 
 import os
+from datetime import datetime, timedelta
+from uuid import uuid4
 from dotenv import load_dotenv
 
 from pintrigue_backend.database.mongodb.db_user import create_user, update_username, get_user_by_email, delete_user, \
-    update_password
+    update_password, duplicate_key_field, rehash_password, login, revoke_user_sessions
+from pintrigue_backend.database.cache import user_cache, user_cache_key
 from pintrigue_backend.api.auth.auth_utils import get_password_hash
 
 import pytest
 from faker import Faker
+from pymongo.errors import DuplicateKeyError
 
 load_dotenv()
 
@@ -30,10 +34,9 @@ class TestUser:
 def create_test_user():
     fake_profile = fake.simple_profile()
     image_id = f"https://storage.googleapis.com/{BUCKET_NAME}/No_image_available.svg.png"
-    create_user(name=fake_profile['name'], username=fake_profile['username'], email=fake_profile['mail'],
-                hashedpw=get_password_hash('test123'), image_id=image_id)
-    user = get_user_by_email(email=fake_profile['mail'])
-    return user
+    response = create_user(name=fake_profile['name'], username=fake_profile['username'], email=fake_profile['mail'],
+                           hashedpw=get_password_hash('test123'), image_id=image_id)
+    return response['user']
 
 
 class TestUserClass:
@@ -49,15 +52,45 @@ class TestUserClass:
         user = TestUser(name=fake_profile['name'], username=fake_profile['username'], email=fake_profile['mail'],
                         password="test123")
         image_id = f"https://storage.googleapis.com/{BUCKET_NAME}/No_image_available.svg.png"
-        assert create_user(name=user.name,
-                           username=user.username,
-                           email=user.email,
-                           hashedpw=get_password_hash(user.password),
-                           image_id=image_id) == {"success": True}
-        new_user = get_user_by_email(email=user.email)
+        response = create_user(name=user.name,
+                               username=user.username,
+                               email=user.email,
+                               hashedpw=get_password_hash(user.password),
+                               image_id=image_id)
+        assert response["success"]
+        new_user = response["user"]
+        assert (new_user["username"], new_user["email"]) == (user.username, user.email)
+        assert "password" not in new_user and "_id" not in new_user
+        assert get_user_by_email(email=user.email)["user_id"] == new_user["user_id"]
         # delete the newly created account to stop filling db with test info
         delete_user(user_id=str(new_user['user_id']), email=new_user['email'])  # clean up
 
+    def test_create_user_duplicate(self, create_test_user):
+        """
+        Tests that the unique indexes refuse a taken username or email, and that the field is reported
+        :param create_test_user:
+        :return:
+        """
+        image_id = f"https://storage.googleapis.com/{BUCKET_NAME}/No_image_available.svg.png"
+        taken_username = create_user(name="Test", username=create_test_user['username'], email=fake.email(),
+                                     hashedpw=get_password_hash('test123'), image_id=image_id)
+        taken_email = create_user(name="Test", username=f"new_{create_test_user['username']}",
+                                  email=create_test_user['email'], hashedpw=get_password_hash('test123'),
+                                  image_id=image_id)
+        assert taken_username["field"] == "username"
+        assert taken_email["field"] == "email"
+        delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
+
+    def test_duplicate_key_field(self):
+        """
+        Tests reading the field from the key pattern, or from the index name of older servers
+        :return:
+        """
+        assert duplicate_key_field(DuplicateKeyError("E11000", 11000, {"keyPattern": {"email": 1}})) == "email"
+        assert duplicate_key_field(DuplicateKeyError(
+            "E11000 duplicate key error collection: pintrigue.users index: username_1 dup key", 11000)) == "username"
+        assert duplicate_key_field(DuplicateKeyError("E11000", 11000)) is None
+
     def test_update_username(self, create_test_user):
         """
         Tests the update_username function, takes the newly created User from create_test_user and then delete after the
@@ -72,6 +105,27 @@ class TestUserClass:
                                ) == {"success": True}
         delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
 
+    def test_update_username_taken(self, create_test_user):
+        """
+        Tests that renaming to the username of another user is refused and leaves both users unchanged
+        :param create_test_user:
+        :return:
+        """
+        fake_profile = fake.simple_profile()
+        image_id = f"https://storage.googleapis.com/{BUCKET_NAME}/No_image_available.svg.png"
+        other_user = create_user(name=fake_profile['name'], username=fake_profile['username'],
+                                 email=fake_profile['mail'], hashedpw=get_password_hash('test123'),
+                                 image_id=image_id)['user']
+        response = update_username(user_id=str(create_test_user['user_id']),
+                                   current_username=create_test_user['username'],
+                                   new_username=other_user['username'])
+        assert "error" in response
+        assert response["field"] == "username"
+        assert get_user_by_email(email=create_test_user['email'])['username'] == create_test_user['username']
+        assert get_user_by_email(email=other_user['email'])['user_id'] == other_user['user_id']
+        delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
+        delete_user(user_id=str(other_user['user_id']), email=other_user['email'])  # clean up
+
     def test_update_password(self, create_test_user):
         """
         Tests the update_password function, takes the newly created User from create_test_user and then deletes it after
@@ -84,6 +138,48 @@ class TestUserClass:
                                new_password=get_password_hash('updated_password1')) == {"success": True}
         delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
 
+    def test_rehash_password(self, create_test_user):
+        """
+        Tests that rehash_password replaces the hash it was given as the old one
+        :param create_test_user:
+        :return:
+        """
+        old_hash = get_user_by_email(email=create_test_user['email'])['password']
+        new_hash = get_password_hash('test123')
+        assert rehash_password(user_id=create_test_user['user_id'], old_password=old_hash,
+                               new_password=new_hash) == {"success": True}
+        assert get_user_by_email(email=create_test_user['email'])['password'] == new_hash
+        delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
+
+    def test_rehash_password_after_change(self, create_test_user):
+        """
+        Tests that a rehash computed from a hash that has since been replaced (the password changed meanwhile)
+        leaves the new password alone
+        :param create_test_user:
+        :return:
+        """
+        old_hash = get_user_by_email(email=create_test_user['email'])['password']
+        changed_hash = get_password_hash('updated_password1')
+        update_password(user_id=str(create_test_user['user_id']), new_password=changed_hash)
+        rehash_password(user_id=create_test_user['user_id'], old_password=old_hash,
+                        new_password=get_password_hash('test123'))
+        assert get_user_by_email(email=create_test_user['email'])['password'] == changed_hash
+        delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
+
+    def test_login_drops_cached_user(self, create_test_user):
+        """
+        Tests that signing in drops the cached copy of the user, so it is read from the db again
+        :param create_test_user:
+        :return:
+        """
+        key = user_cache_key(create_test_user['user_id'])
+        user_cache().set(key, {**create_test_user, "username": "stale"})
+        assert login(user_id=create_test_user['user_id'], jti=uuid4().hex,
+                     expires_at=datetime.utcnow() + timedelta(minutes=30)) == {"success": True}
+        assert user_cache().get(key) is None
+        revoke_user_sessions(create_test_user['user_id'])  # clean up
+        delete_user(user_id=str(create_test_user['user_id']), email=create_test_user['email'])  # clean up
+
     def test_delete_user(self, create_test_user):
         """
         Tests the delete_user function, takes the newly created User from create_test_user